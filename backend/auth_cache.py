@@ -0,0 +1,98 @@
+import time
+import hashlib
+from collections import OrderedDict
+
+class TokenCache:
+    """
+    LRU of already verified JWTs.
+    Keyed by a SHA-256 of the token so raw bearer tokens never sit in memory
+    as dict keys; an entry is only honoured until the token's own `exp`.
+    """
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, token, username, exp):
+        key = self._key(token)
+        self._entries[key] = (username, exp)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+class UserCache:
+    """
+    Write-through cache of recently active users ({_id, password, state}).
+    Every write to db.users goes through the owner of this cache first, so
+    entries stay authoritative; the TTL bounds staleness from other writers.
+    """
+    FIELDS = ("_id", "username", "password", "state", "state_version", "state_marks")
+
+    def __init__(self, max_entries=5000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username):
+        entry = self._entries.get(username)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            self._entries.pop(username, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(username)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, user):
+        doc = {field: user[field] for field in self.FIELDS if field in user}
+        self._entries[doc["username"]] = (doc, time.monotonic())
+        self._entries.move_to_end(doc["username"])
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return doc
+
+    def update(self, username, **fields):
+        """Applies a write that already reached MongoDB to the cached copy."""
+        entry = self._entries.get(username)
+        if entry is not None:
+            entry[0].update(fields)
+
+    def invalidate(self, username):
+        self._entries.pop(username, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
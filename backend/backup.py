@@ -1,39 +1,194 @@
+import io
 import os
+import sys
+import gzip
 import asyncio
-import json
+import argparse
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne
+from bson import json_util
 from dotenv import load_dotenv
 from datetime import datetime
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 load_dotenv()
 
-async def backup_database():
+STATE_FILE = os.getenv("BACKUP_STATE_FILE", "backup_state.json")
+# Relaxed extended JSON keeps ObjectId/datetime types so a restore round-trips them
+JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS
+
+def open_compressed(path, mode):
+    """Text-mode handle for .ndjson, .ndjson.gz or .ndjson.zst files."""
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("Install 'zstandard' to read or write .zst backups")
+        if "w" in mode:
+            raw = zstandard.ZstdCompressor(level=10).stream_writer(open(path, "wb"))
+        else:
+            raw = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        return io.TextIOWrapper(raw, encoding="utf-8")
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def load_state():
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json_util.loads(f.read())
+    except FileNotFoundError:
+        return {}
+
+def save_state(state):
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(json_util.dumps(state, json_options=JSON_OPTIONS))
+    os.replace(tmp, STATE_FILE)
+
+async def pick_collection(db):
+    # Check which collection we are using
+    if await db.master_library.estimated_document_count() > 0:
+        return "master_library"
+    return "songs"
+
+async def backup_database(incremental=False, compression=None):
     print("🛡️ STARTING SAFETY BACKUP...")
     client = AsyncIOMotorClient(os.getenv("MONGO_URL"))
     db = client[os.getenv("DB_NAME", "music_app_pro")]
-    
-    # Check which collection we are using
-    collection_name = "songs"
-    if await db.master_library.count_documents({}) > 0:
-        collection_name = "master_library"
-    
-    print(f"📦 Backing up collection: '{collection_name}'...")
-    
-    songs = await db[collection_name].find({}).to_list(length=20000)
-    
-    # Save to a local file with a timestamp
-    filename = f"backup_songs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    
-    with open(filename, "w", encoding="utf-8") as f:
-        # Convert ObjectId and ints to strings for JSON compatibility
-        json_ready = []
-        for s in songs:
-            s["_id"] = str(s["_id"])
-            json_ready.append(s)
-        json.dump(json_ready, f, indent=4)
-        
+    collection_name = await pick_collection(db)
+
+    state = load_state()
+    watermark = state.get(collection_name, {})
+    query = {}
+    if incremental and watermark:
+        # New documents (by _id) plus anything edited since the last run.
+        # final.py, smart_tagger.py and updater_bot.py stamp updated_at; edits
+        # made by hand without it only reach the next full backup.
+        last_updated = watermark.get("last_updated")
+        edited = {"$gt": last_updated} if last_updated is not None else {"$ne": None}
+        query = {"$or": [{"_id": {"$gt": watermark["last_id"]}}, {"updated_at": edited}]}
+        print(f"📦 Incremental backup of '{collection_name}' since _id {watermark['last_id']}...")
+    else:
+        print(f"📦 Backing up collection: '{collection_name}'...")
+
+    compression = compression or ("zst" if zstandard else "gz")
+    kind = "incr" if query else "full"
+    filename = f"backup_{collection_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{kind}.ndjson.{compression}"
+
+    count = 0
+    last_id = watermark.get("last_id")
+    last_updated = watermark.get("last_updated")
+    cursor = db[collection_name].find(query).sort("_id", 1).batch_size(1000)
+    with open_compressed(filename, "w") as f:
+        async for doc in cursor:
+            f.write(json_util.dumps(doc, json_options=JSON_OPTIONS))
+            f.write("\n")
+            count += 1
+            if last_id is None or doc["_id"] > last_id:
+                last_id = doc["_id"]
+            updated = doc.get("updated_at")
+            if isinstance(updated, datetime) and (last_updated is None or updated > last_updated):
+                last_updated = updated
+            if count % 10000 == 0:
+                print(f"   ...{count} documents written")
+
+    # Only advance the watermark once the file is complete
+    if last_id is not None:
+        state[collection_name] = {"last_id": last_id, "last_updated": last_updated}
+        save_state(state)
+
     print(f"✅ BACKUP SAVED: {filename}")
-    print(f"🔒 You have {len(songs)} songs saved safely on your computer.")
+    print(f"🔒 You have {count} songs saved safely on your computer.")
+    return filename
+
+async def _restore_worker(collection, batches, totals):
+    while True:
+        batch = await batches.get()
+        if batch is None:
+            return
+        # Upserts make restores idempotent and let incremental files replay on top
+        result = await collection.bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in batch], ordered=False
+        )
+        totals["upserted"] += result.upserted_count
+        totals["replaced"] += result.modified_count
+
+async def _feed(batches, item, tasks):
+    """Queues `item`, surfacing a crashed worker instead of blocking on a full queue."""
+    put = asyncio.ensure_future(batches.put(item))
+    while True:
+        # Workers that already took their None sentinel are done but healthy
+        for task in tasks:
+            if task.done() and (task.cancelled() or task.exception()):
+                put.cancel()
+                task.result()
+        running = [task for task in tasks if not task.done()]
+        if not running:
+            put.cancel()
+            raise RuntimeError("All restore workers exited")
+        done, _ = await asyncio.wait([put, *running], return_when=asyncio.FIRST_COMPLETED)
+        if put in done:
+            return
+
+async def restore_database(paths, collection_name=None, workers=4, batch_size=1000):
+    client = AsyncIOMotorClient(os.getenv("MONGO_URL"))
+    db = client[os.getenv("DB_NAME", "music_app_pro")]
+    collection = db[collection_name or await pick_collection(db)]
+    print(f"♻️ Restoring {len(paths)} file(s) into '{collection.name}' with {workers} workers...")
+
+    totals = {"read": 0, "upserted": 0, "replaced": 0}
+    # Files are applied in the order given (full backup first, then incrementals);
+    # each one is fully written before the next so newer versions land last
+    for path in paths:
+        batches = asyncio.Queue(maxsize=workers * 2)
+        tasks = [asyncio.create_task(_restore_worker(collection, batches, totals)) for _ in range(workers)]
+        try:
+            batch = []
+            with open_compressed(path, "r") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    batch.append(json_util.loads(line, json_options=JSON_OPTIONS))
+                    if len(batch) >= batch_size:
+                        await _feed(batches, batch, tasks)
+                        totals["read"] += len(batch)
+                        batch = []
+            if batch:
+                await _feed(batches, batch, tasks)
+                totals["read"] += len(batch)
+            for _ in tasks:
+                await _feed(batches, None, tasks)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        print(f"   ...{path}: {totals['read']} documents so far")
+
+    print(f"✅ RESTORE COMPLETE: {totals['read']} read, {totals['upserted']} inserted, {totals['replaced']} replaced")
+    return totals
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Streaming backup/restore for the song library")
+    sub = parser.add_subparsers(dest="command")
+    backup = sub.add_parser("backup", help="Write an NDJSON backup (default)")
+    backup.add_argument("--incremental", action="store_true", help="Only documents past the last watermark")
+    backup.add_argument("--compression", choices=["gz", "zst"], default=None)
+    restore = sub.add_parser("restore", help="Upsert documents from backup files")
+    restore.add_argument("files", nargs="+")
+    restore.add_argument("--collection", default=None)
+    restore.add_argument("--workers", type=int, default=4)
+    restore.add_argument("--batch-size", type=int, default=1000)
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    asyncio.run(backup_database())
\ No newline at end of file
+    args = parse_args(sys.argv[1:])
+    if args.command == "restore":
+        asyncio.run(restore_database(args.files, args.collection, args.workers, args.batch_size))
+    else:
+        asyncio.run(backup_database(
+            incremental=getattr(args, "incremental", False),
+            compression=getattr(args, "compression", None)
+        ))
@@ -0,0 +1,306 @@
+"""
+Offline benchmark for the API: runs main.app in-process against fake
+Telegram bots (fake_telegram.py) and a seeded MongoDB, then prints one
+JSON report with latency percentiles, throughput and event-loop lag per
+scenario. Compare reports between commits to see what a change did.
+
+    python benchmark.py --songs 20000 --requests 500 --concurrency 32 --out bench.json
+
+Without --mongo-url the database is in-memory (needs mongomock-motor);
+with it, a throwaway database is seeded on that server and dropped after.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+SCENARIOS = ("songs", "stream", "login", "sync")
+
+WORDS = ["love", "night", "dance", "heart", "rain", "fire", "moon", "summer", "dream",
+         "city", "road", "home", "blue", "gold", "wild", "echo", "river", "star"]
+GENRES = ["Pop", "Rock", "Bollywood", "Lo-Fi", "Electronic", "Hip-Hop", "Jazz", "K-Pop"]
+MOODS = ["Happy", "Sad", "Chill", "Energetic", "Romantic", "Party", "Focus"]
+LANGUAGES = ["English", "Hindi", "Bengali", "Punjabi", "Korean"]
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, min(len(sorted_values), round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[rank - 1]
+
+class LoopLagMonitor:
+    """Samples how late a periodic sleep wakes up: a direct read of event-loop stalls."""
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def start(self):
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        lags = sorted(self.samples)
+        return {
+            "p50_ms": round(percentile(lags, 50) * 1000, 3),
+            "p99_ms": round(percentile(lags, 99) * 1000, 3),
+            "max_ms": round((lags[-1] if lags else 0.0) * 1000, 3)
+        }
+
+def seed_documents(count, seed=0):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    for msg_id in range(1, count + 1):
+        seconds = rng.randint(90, 480)
+        yield {
+            "_id": msg_id,
+            "title": " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title() + f" {msg_id}",
+            "artist": f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}",
+            "genre": rng.choice(GENRES),
+            "mood": rng.choice(MOODS),
+            "language": rng.choice(LANGUAGES),
+            "duration": f"{seconds // 60}:{seconds % 60:02d}",
+            "duration_seconds": seconds,
+            "album_art": None,
+            "is_hidden": rng.random() < 0.02,
+            "updated_at": now
+        }
+
+async def seed_library(db, count, batch_size=5000):
+    await db.master_library.delete_many({})
+    batch = []
+    for doc in seed_documents(count):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            await db.master_library.insert_many(batch)
+            batch = []
+    if batch:
+        await db.master_library.insert_many(batch)
+
+async def run_scenario(request, total, concurrency):
+    """Fires `total` calls of `request()` from `concurrency` workers; returns the metrics."""
+    latencies = []
+    statuses = {}
+    state = {"issued": 0, "bytes": 0, "errors": 0}
+    monitor = LoopLagMonitor()
+
+    async def worker():
+        while state["issued"] < total:
+            state["issued"] += 1
+            started = time.perf_counter()
+            try:
+                status, nbytes = await request()
+            except Exception:
+                status, nbytes = "exception", 0
+            latencies.append(time.perf_counter() - started)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            state["bytes"] += nbytes
+            if status == "exception" or (isinstance(status, int) and status >= 400):
+                state["errors"] += 1
+
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    lag = await monitor.stop()
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": state["errors"],
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "requests_per_sec": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "bytes_per_sec": round(state["bytes"] / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p95": round(percentile(latencies, 95) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+            "max": round((latencies[-1] if latencies else 0.0) * 1000, 3)
+        },
+        "event_loop_lag": lag
+    }
+
+def configure_environment(args):
+    """Settings main.py reads at import time; must run before importing it."""
+    os.environ.setdefault("JWT_SECRET", "benchmark-secret-not-for-production-use")
+    os.environ.setdefault("API_ID", "1")
+    os.environ.setdefault("API_HASH", "benchmark")
+    os.environ.setdefault("CHANNEL_ID", "-1001")
+    os.environ["AUDIO_CACHE_DIR"] = tempfile.mkdtemp(prefix="bench-audio-")
+    os.environ["AUDIO_CACHE_MAX_MB"] = str(args.audio_cache_mb)
+    os.environ["MAX_STREAMS_PER_BOT"] = str(args.streams_per_bot)
+    if args.mongo_url:
+        os.environ["MONGO_URL"] = args.mongo_url
+        os.environ["DB_NAME"] = f"bench_{os.getpid()}"
+    else:
+        import motor.motor_asyncio
+        from mongomock_motor import AsyncMongoMockClient
+        # main.py builds its client at import time, so swap the class first
+        motor.motor_asyncio.AsyncIOMotorClient = lambda *a, **k: AsyncMongoMockClient()
+        os.environ["MONGO_URL"] = "mongodb://in-memory"
+        os.environ["INDEX_SELF_CHECK"] = "0"
+
+async def wait_until(predicate, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError("Benchmark target did not become ready")
+        await asyncio.sleep(0.05)
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def benchmark(args):
+    configure_environment(args)
+    import httpx
+    import main
+    from fake_telegram import FakeNetwork, fake_client_factory
+
+    logging.getLogger().setLevel(logging.WARNING)
+    network = FakeNetwork(
+        latency=args.latency_ms / 1000, bandwidth=args.bandwidth_mbps * 1024 * 1024 / 8,
+        flood_rate=args.flood_rate, file_size=args.file_kb * 1024
+    )
+    main.manager.client_factory = fake_client_factory(network)
+    main.manager.tokens = [(i, f"fake-token-{i}") for i in range(args.bots)]
+
+    await seed_library(main.db, args.songs)
+    rng = random.Random(1)
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "mongo_url")},
+        "database": "mongod" if args.mongo_url else "in-memory",
+        "scenarios": {}
+    }
+
+    async with main.lifespan(main.app):
+        await wait_until(lambda: main.catalog.ready and main.manager.ready_count() == args.bots)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            users = [f"bench_user_{i}" for i in range(args.users)]
+            for username in users:
+                await client.post("/auth/register", json={"username": username, "password": "bench-pass"})
+            tokens = []
+            for username in users:
+                r = await client.post("/auth/login", json={"username": username, "password": "bench-pass"})
+                tokens.append(r.json()["access_token"])
+
+            async def songs():
+                params = {"limit": 50}
+                roll = rng.random()
+                if roll < 0.3:
+                    params["genre"] = rng.choice(GENRES)
+                elif roll < 0.5:
+                    params["mood"] = rng.choice(MOODS)
+                elif roll < 0.7:
+                    params["search"] = rng.choice(WORDS)
+                r = await client.get("/songs", params=params)
+                return r.status_code, len(r.content)
+
+            hot_ids = list(range(1, min(args.songs, 50) + 1))
+
+            async def stream():
+                # Mostly popular tracks (warm cache), some long-tail ones
+                msg_id = rng.choice(hot_ids) if rng.random() < 0.7 else rng.randint(1, args.songs)
+                r = await client.get(f"/stream/{msg_id}", headers={"Range": "bytes=0-"})
+                return r.status_code, len(r.content)
+
+            async def login():
+                username = rng.choice(users)
+                r = await client.post("/auth/login", json={"username": username, "password": "bench-pass"})
+                return r.status_code, len(r.content)
+
+            async def sync():
+                headers = {"Authorization": f"Bearer {rng.choice(tokens)}"}
+                if rng.random() < 0.5:
+                    song_id = str(rng.randint(1, args.songs))
+                    patch = {"liked_add": [{"id": song_id, "title": "bench"}]}
+                else:
+                    patch = {"updates": {"volume": round(rng.random(), 2)}}
+                r = await client.post("/user/sync/patch", json=patch, headers=headers)
+                return r.status_code, len(r.content)
+
+            requests = {"songs": songs, "stream": stream, "login": login, "sync": sync}
+            for name in args.scenarios:
+                total = args.requests if name != "stream" else args.stream_requests
+                print(f"⏱️ Running '{name}' ({total} requests, concurrency {args.concurrency})...", file=sys.stderr)
+                report["scenarios"][name] = await run_scenario(requests[name], total, args.concurrency)
+
+        report["fake_telegram"] = {
+            "requests": network.requests, "flood_waits": network.floods, "bytes_served": network.bytes_served
+        }
+        report["caches"] = {
+            "audio": main.chunk_cache.stats(),
+            "responses": main.response_cache.stats(),
+            "hashing": main.password_hasher.stats()
+        }
+
+    if args.mongo_url:
+        await main.mongo_client.drop_database(os.environ["DB_NAME"])
+    return report
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Offline API benchmark with fake Telegram bots")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--songs", type=int, default=10000, help="Generated master_library size")
+    parser.add_argument("--requests", type=int, default=300, help="Requests per scenario")
+    parser.add_argument("--stream-requests", type=int, default=60, help="Requests for the stream scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--bots", type=int, default=3)
+    parser.add_argument("--streams-per-bot", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=40.0, help="Fake Telegram per-request latency")
+    parser.add_argument("--bandwidth-mbps", type=float, default=80.0, help="Fake Telegram bandwidth per request")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="Probability a download raises FloodWait")
+    parser.add_argument("--file-kb", type=int, default=2048, help="Size of every fake audio file")
+    parser.add_argument("--audio-cache-mb", type=int, default=256, help="0 disables the chunk cache")
+    parser.add_argument("--mongo-url", default=None, help="Use a real mongod instead of in-memory Mongo")
+    parser.add_argument("--out", default=None, help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    # Progress prints from the app go to stderr so stdout stays pure JSON
+    with redirect_stdout(sys.stderr):
+        report = asyncio.run(benchmark(args))
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"📊 Report written to {args.out}", file=sys.stderr)
+    else:
+        print(output)
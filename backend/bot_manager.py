@@ -1,94 +1,455 @@
 import os
+import re
 import time
 import asyncio
 import logging
+from collections import deque
 from telethon import TelegramClient, errors
 from dotenv import load_dotenv
+from media_cache import MediaCache, MediaDescriptor
 
 load_dotenv()
 
 # Setup internal logger
 logger = logging.getLogger("BotManager")
 
+# Recent errors fade out of a bot's load score with this half-life (seconds)
+ERROR_HALF_LIFE = 60.0
+FLOOD_WAIT_WEIGHT = 3.0
+
+# Startup and reconnect policy (seconds); see README for the env vars
+CONNECT_TIMEOUT = float(os.getenv("BOT_CONNECT_TIMEOUT", "15"))
+CONNECT_RETRIES = int(os.getenv("BOT_CONNECT_RETRIES", "3"))
+CONNECT_BACKOFF = float(os.getenv("BOT_CONNECT_BACKOFF", "2"))
+HEALTH_INTERVAL = float(os.getenv("BOT_HEALTH_INTERVAL", "30"))
+
+class SwarmBusyError(Exception):
+    """Raised when no bot frees up a stream slot before the queue timeout."""
+
+def load_bot_tokens():
+    """
+    Collects every BOT_TOKEN_n variable, ordered by n.
+    Returns (index, token) pairs where index = n - 1 keeps session files stable.
+    """
+    tokens = []
+    for key, value in os.environ.items():
+        match = re.fullmatch(r"BOT_TOKEN_(\d+)", key)
+        if match and value:
+            tokens.append((int(match.group(1)) - 1, value))
+    return sorted(tokens)
+
 class BotWorker:
-    def __init__(self, index, token, api_id, api_hash):
+    def __init__(self, index, token, api_id, api_hash, client_factory=TelegramClient):
         self.index = index
         self.token = token
         # Automatically handle the session directory
         if not os.path.exists('sessions'):
             os.makedirs('sessions')
-        self.client = TelegramClient(f'sessions/bot_worker_{index}', api_id, api_hash)
+        # client_factory(session, api_id, api_hash) lets benchmarks swap in a fake client
+        self.client = client_factory(f'sessions/bot_worker_{index}', api_id, api_hash)
         self.cooldown_until = 0 
         self.is_ready = False
+        self.state = "pending"  # pending -> connecting -> ready | failed
+        self.last_error = None
+        self.connect_attempts = 0
+        self.reconnects = 0
+        # Load tracking used by the scheduler
+        self.active_streams = 0
+        self.in_flight = 0
+        self.bytes_sent = 0
+        self.bytes_per_sec = 0.0
+        self.errors = 0
+        self.flood_waits = 0
+        self._error_score = 0.0
+        self._error_stamp = time.monotonic()
 
-    async def start(self):
-        try:
-            await self.client.start(bot_token=self.token)
-            self.is_ready = True
-            print(f"    ✅ Bot {self.index + 1} Connected")
-        except Exception as e:
-            print(f"    ❌ Bot {self.index + 1} Failed: {e}")
-            self.is_ready = False
+    async def start(self, timeout=CONNECT_TIMEOUT, retries=CONNECT_RETRIES):
+        """
+        Connects with a per-attempt timeout, retrying with exponential backoff.
+        Returns True once the bot is ready; never raises.
+        """
+        self.state = "connecting"
+        for attempt in range(retries + 1):
+            self.connect_attempts += 1
+            try:
+                await asyncio.wait_for(self.client.start(bot_token=self.token), timeout)
+                self.is_ready = True
+                self.state = "ready"
+                self.last_error = None
+                logger.info("✅ Bot %s Connected", self.index + 1)
+                return True
+            except errors.FloodWaitError as e:
+                # Login flood: waiting out the penalty beats burning retries
+                self.last_error = f"FloodWait {e.seconds}s"
+                delay = e.seconds
+            except Exception as e:
+                self.last_error = str(e) or type(e).__name__
+                delay = CONNECT_BACKOFF * 2 ** attempt
+            if attempt < retries:
+                logger.warning("⚠️ Bot %s connect attempt %s failed (%s), retrying in %ss",
+                               self.index + 1, attempt + 1, self.last_error, delay)
+                await asyncio.sleep(delay)
+        self.is_ready = False
+        self.state = "failed"
+        logger.error("❌ Bot %s Failed: %s", self.index + 1, self.last_error)
+        return False
+
+    def is_connected(self):
+        return self.is_ready and self.client.is_connected()
 
     def is_available(self):
         """Checks if bot is active and not cooling down."""
-        return self.is_ready and self.client.is_connected() and time.time() >= self.cooldown_until
+        return self.is_connected() and time.time() >= self.cooldown_until
 
     def trigger_cooldown(self, seconds):
-        print(f"    ⚠️ Bot {self.index + 1} hit FloodWait! Sleeping for {seconds}s.")
+        logger.warning("⚠️ Bot %s hit FloodWait! Sleeping for %ss.", self.index + 1, seconds)
         self.cooldown_until = time.time() + seconds
+        self.flood_waits += 1
+        self.record_error(FLOOD_WAIT_WEIGHT)
+
+    def begin_request(self):
+        self.in_flight += 1
+
+    def end_request(self, nbytes, elapsed):
+        """Closes an in-flight download and folds it into the bytes/sec average."""
+        self.in_flight = max(self.in_flight - 1, 0)
+        self.bytes_sent += nbytes
+        if nbytes and elapsed > 0:
+            rate = nbytes / elapsed
+            self.bytes_per_sec = rate if not self.bytes_per_sec else 0.8 * self.bytes_per_sec + 0.2 * rate
+
+    def record_error(self, weight=1.0):
+        self._error_score = self.error_score() + weight
+        self._error_stamp = time.monotonic()
+        self.errors += 1
+
+    def error_score(self):
+        """Exponentially decayed error/FloodWait history."""
+        elapsed = time.monotonic() - self._error_stamp
+        return self._error_score * 0.5 ** (elapsed / ERROR_HALF_LIFE)
+
+    def load_score(self):
+        """Lower is better: open streams, queued part requests and recent trouble."""
+        return self.active_streams + 0.25 * self.in_flight + 2 * self.error_score()
 
 class BotManager:
-    def __init__(self):
+    def __init__(self, client_factory=TelegramClient):
         self.workers = []
-        self.current_index = 0
+        self.client_factory = client_factory
         self.api_id = int(os.getenv("API_ID"))
         self.api_hash = os.getenv("API_HASH")
         self.channel_id = int(os.getenv("CHANNEL_ID"))
-        # Swarm configuration from .env
-        self.tokens = [
-            os.getenv("BOT_TOKEN_1"),
-            os.getenv("BOT_TOKEN_2"),
-            os.getenv("BOT_TOKEN_3")
-        ]
+        # Swarm configuration from .env (any number of BOT_TOKEN_n)
+        self.tokens = load_bot_tokens()
+        self.max_streams_per_bot = int(os.getenv("MAX_STREAMS_PER_BOT", "8"))
+        self.queue_timeout = float(os.getenv("BOT_QUEUE_TIMEOUT", "5"))
+        self._waiters = deque()
+        self.media_cache = MediaCache(
+            max_entries=int(os.getenv("MEDIA_CACHE_SIZE", "5000")),
+            ttl=int(os.getenv("MEDIA_CACHE_TTL", "3600"))
+        )
+        self._pending_lookups = {}
+        # Only files this large are worth warming helper bots for parallel parts
+        self.helper_min_bytes = int(float(os.getenv("STREAM_HELPER_MIN_MB", "16")) * 1024 * 1024)
+        # Streams arriving during warm-up wait this long for the first bot
+        self.ready_timeout = float(os.getenv("BOT_READY_TIMEOUT", "10"))
+        self.health_interval = HEALTH_INTERVAL
+        self.ready = asyncio.Event()
+        self.started = False
+
+    def assign_partition(self, slot, slots):
+        """
+        Multi-process mode: keep every `slots`-th token starting at `slot`, so
+        each session file (and Telegram login) belongs to exactly one process.
+        Raises RuntimeError when there are fewer tokens than processes: a
+        process without bots would answer every /stream it is handed with 503.
+        """
+        if slots > 1 and len(self.tokens) < slots:
+            raise RuntimeError(
+                f"WEB_CONCURRENCY={slots} needs at least {slots} BOT_TOKEN_n, found {len(self.tokens)}"
+            )
+        self.tokens = self.tokens[slot::slots]
 
     async def start(self):
-        print(f"🤖 [Load Balancer] Initializing Swarm...")
-        for i, token in enumerate(self.tokens):
-            if token:
-                worker = BotWorker(i, token, self.api_id, self.api_hash)
-                await worker.start()
-                self.workers.append(worker)
-        print(f"🚀 [Load Balancer] {len(self.workers)} Bots Active.")
+        """
+        Connects every bot concurrently. `ready` is set as soon as the first
+        one is up, so streams start flowing before the slowest bot finishes.
+        """
+        logger.info("🤖 [Load Balancer] Initializing Swarm...")
+        self.workers = [
+            BotWorker(i, token, self.api_id, self.api_hash, self.client_factory)
+            for i, token in self.tokens
+        ]
+
+        async def connect(worker):
+            if await worker.start():
+                self.ready.set()
+
+        await asyncio.gather(*(connect(w) for w in self.workers))
+        self.started = True
+        logger.info("🚀 [Load Balancer] %s/%s Bots Active.", self.ready_count(), len(self.workers))
+
+    async def run(self):
+        """start(), then keep reconnecting dead bots every BOT_HEALTH_INTERVAL seconds."""
+        await self.start()
+        reconnecting = {}
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for worker in self.workers:
+                task = reconnecting.get(worker.index)
+                if worker.is_connected() or (task and not task.done()):
+                    continue
+                worker.is_ready = False
+                worker.reconnects += 1
+                logger.warning("🔌 Bot %s is down, reconnecting in the background", worker.index + 1)
+                reconnecting[worker.index] = asyncio.create_task(self._reconnect(worker))
+            if self.ready_count():
+                self.ready.set()
+            else:
+                self.ready.clear()
+
+    async def _reconnect(self, worker):
+        if await worker.start():
+            self.ready.set()
+
+    def ready_count(self):
+        return sum(1 for w in self.workers if w.is_connected())
+
+    async def wait_ready(self, timeout=None):
+        """Waits (up to `timeout`) for at least one connected bot; returns whether there is one."""
+        if self.ready.is_set():
+            return True
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def status(self):
+        """Swarm readiness summary for /health/ready."""
+        ready = self.ready_count()
+        if ready == len(self.workers) and ready:
+            state = "ready"
+        elif ready:
+            state = "degraded"
+        else:
+            state = "down" if self.started else "starting"
+        return {
+            "state": state,
+            "ready": ready,
+            "total": len(self.tokens),
+            "bots": [
+                {
+                    "bot": w.index + 1,
+                    "state": w.state if w.state != "ready" or w.is_connected() else "disconnected",
+                    "attempts": w.connect_attempts,
+                    "reconnects": w.reconnects,
+                    "cooldown": round(max(0.0, w.cooldown_until - time.time()), 1),
+                    "last_error": w.last_error
+                }
+                for w in self.workers
+            ]
+        }
+
+    def _pick_worker(self, message_id=None, exclude=(), capped=True):
+        """
+        Least-loaded selection. Ties go to a bot that already has the file's
+        descriptor cached, then to the bot with the best recent throughput.
+        """
+        candidates = [
+            w for w in self.workers
+            if w.index not in exclude and w.is_available()
+            and (not capped or w.active_streams < self.max_streams_per_bot)
+        ]
+        if not candidates:
+            return None
+
+        def rank(w):
+            uncached = message_id is None or self.media_cache.peek(w.index, message_id) is None
+            return (w.load_score(), uncached, -w.bytes_per_sec)
+
+        return min(candidates, key=rank)
 
     def get_healthy_bot(self):
-        """Round-Robin bot selection."""
-        attempts = 0
-        while attempts < len(self.workers):
-            worker = self.workers[self.current_index]
-            self.current_index = (self.current_index + 1) % len(self.workers)
-            if worker.is_available():
+        """Least-loaded available bot, for short RPCs that do not hold a stream slot."""
+        worker = self._pick_worker(capped=False)
+        if not worker:
+            raise SwarmBusyError("🔥 ALL BOTS BUSY OR DEAD.")
+        return worker
+
+    def has_spare_capacity(self, headroom=1):
+        """True when nobody is queued and some bot has `headroom` free stream slots."""
+        if any(not w.done() for w in self._waiters):
+            return False
+        return any(
+            w.is_available() and w.active_streams + headroom < self.max_streams_per_bot
+            for w in self.workers
+        )
+
+    async def acquire_stream(self, message_id=None, exclude=()):
+        """
+        Claims a stream slot on the least-loaded bot.
+        When every bot is at MAX_STREAMS_PER_BOT (or cooling down) the request
+        waits in a FIFO queue for up to BOT_QUEUE_TIMEOUT seconds.
+        """
+        deadline = time.monotonic() + self.queue_timeout
+        while True:
+            worker = self._pick_worker(message_id, exclude)
+            if worker:
+                worker.active_streams += 1
                 return worker
-            attempts += 1
-        raise Exception("🔥 ALL BOTS BUSY OR DEAD.")
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise SwarmBusyError("🔥 ALL BOTS BUSY OR DEAD.")
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                # Re-check periodically: cooldowns expire without a release
+                await asyncio.wait_for(waiter, timeout=min(remaining, 1.0))
+            except asyncio.TimeoutError:
+                pass
+
+    def release_stream(self, worker):
+        worker.active_streams = max(worker.active_streams - 1, 0)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def stream_lease(self, worker):
+        """
+        Idempotent release callback for a claimed stream slot, for handing to
+        whatever owns the response (see streaming.LeasedStreamingResponse).
+        """
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.release_stream(worker)
+        return release
+
+    async def _fetch_descriptor(self, worker, message_id):
+        """Reads one message through `worker`, sharing the RPC between concurrent callers."""
+        key = (worker.index, message_id)
+        pending = self._pending_lookups.get(key)
+        if pending:
+            return await asyncio.shield(pending)
+
+        async def lookup():
+            try:
+                message = await worker.client.get_messages(self.channel_id, ids=message_id)
+                descriptor = MediaDescriptor.from_message(message)
+                if descriptor:
+                    self.media_cache.put(worker.index, descriptor)
+                return descriptor
+            finally:
+                self._pending_lookups.pop(key, None)
+
+        task = asyncio.ensure_future(lookup())
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._pending_lookups[key] = task
+        return await asyncio.shield(task)
 
     async def get_audio_stream(self, message_id):
-        """Fetches the message using a healthy bot from the swarm."""
+        """
+        Resolves a message to (worker, MediaDescriptor) and claims a stream
+        slot on that worker; the caller must hand it back via release_stream
+        (or a stream_lease). A cached descriptor skips the get_messages round trip.
+        """
+        message_id = int(message_id)
+        if not await self.wait_ready(self.ready_timeout):
+            raise SwarmBusyError("🔥 SWARM NOT READY.")
+        tried = set()
         for attempt in range(len(self.workers)):
-            try:
-                worker = self.get_healthy_bot()
-                message = await worker.client.get_messages(self.channel_id, ids=int(message_id))
-                
-                # Check for files (handles both audio and document types)
-                if not message or not message.file:
-                    return None, None
+            worker = await self.acquire_stream(message_id, exclude=tried)
+            tried.add(worker.index)
 
-                return worker, message
+            cached = self.media_cache.lookup(message_id, [worker.index])
+            if cached:
+                return worker, cached[1]
 
+            try:
+                descriptor = await self._fetch_descriptor(worker, message_id)
             except errors.FloodWaitError as e:
                 worker.trigger_cooldown(e.seconds)
+                self.release_stream(worker)
                 continue
             except Exception as e:
-                print(f"⚠️ Fetch Error: {e}")
+                logger.warning("⚠️ Fetch Error: %s", e)
+                worker.record_error()
+                self.release_stream(worker)
+                continue
+
+            # Check for files (handles both audio and document types)
+            if not descriptor:
+                self.release_stream(worker)
+                return None, None
+
+            return worker, descriptor
+        return None, None
+
+    def get_stream_sources(self, message_id, worker, descriptor, max_helpers=3):
+        """
+        Returns [(worker, descriptor), ...] for spreading one download across bots.
+        The primary pair comes first; up to `max_helpers` other healthy bots join
+        only when they already hold the file in cache, so fan-out never delays
+        the first byte. For files of at least STREAM_HELPER_MIN_MB, the
+        least-loaded missing helpers resolve the descriptor in the background
+        for the next play; short tracks never cost extra get_messages calls.
+        """
+        message_id = int(message_id)
+        sources = [(worker, descriptor)]
+        uncached = []
+        for other in sorted(self.workers, key=lambda w: w.load_score()):
+            if len(sources) > max_helpers:
+                break
+            if other is worker or not other.is_available():
+                continue
+            if other.active_streams >= self.max_streams_per_bot:
                 continue
-        return None, None
\ No newline at end of file
+            cached = self.media_cache.peek(other.index, message_id)
+            if cached:
+                sources.append((other, cached))
+            elif (other.index, message_id) not in self._pending_lookups:
+                uncached.append(other)
+
+        if (descriptor.size or 0) >= self.helper_min_bytes:
+            for other in uncached[:max_helpers + 1 - len(sources)]:
+                task = asyncio.ensure_future(self._fetch_descriptor(other, message_id))
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return sources
+
+    async def refresh_media(self, worker, message_id):
+        """Drops a stale descriptor (e.g. expired file reference) and re-reads the message."""
+        self.media_cache.invalidate(worker.index, message_id)
+        descriptor = await self._fetch_descriptor(worker, int(message_id))
+        if not descriptor:
+            raise FileNotFoundError(f"Message {message_id} no longer has a file")
+        return descriptor
+
+    async def resolve_many(self, message_ids, batch_size=100):
+        """
+        Warms the metadata cache for many ids at once (e.g. during prefetch).
+        Misses are fetched with batched get_messages calls on one healthy bot.
+        Returns the number of descriptors resolved.
+        """
+        worker = self.get_healthy_bot()
+        missing = self.media_cache.missing(worker.index, [int(i) for i in message_ids])
+        resolved = 0
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            try:
+                messages = await worker.client.get_messages(self.channel_id, ids=batch)
+            except errors.FloodWaitError as e:
+                worker.trigger_cooldown(e.seconds)
+                break
+            for message in messages:
+                descriptor = MediaDescriptor.from_message(message)
+                if descriptor:
+                    self.media_cache.put(worker.index, descriptor)
+                    resolved += 1
+        return resolved
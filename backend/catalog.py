@@ -0,0 +1,485 @@
+import re
+import json
+import time
+import base64
+import asyncio
+import logging
+from bisect import bisect_right
+from pymongo.errors import PyMongoError
+from search_index import SearchIndex
+from classifier import get_duration_category
+
+logger = logging.getLogger("Catalog")
+
+# Only the fields /songs reads are pulled from master_library
+PROJECTION = {
+    "title": 1, "artist": 1, "album_art": 1, "duration": 1, "duration_seconds": 1,
+    "genre": 1, "mood": 1, "language": 1, "is_hidden": 1, "updated_at": 1
+}
+
+# /songs ordering; also the compound index keyset pagination relies on
+SONG_SORT = [("genre", 1), ("title", 1), ("_id", 1)]
+# "src" tag on search cursors from the MongoDB warm-up fallback, whose
+# offsets index a regex match in SONG_SORT order rather than BM25 ranks
+FALLBACK_CURSOR = "db"
+
+EXTENSION_PATTERN = re.compile(r'\.(mp3|m4a|flac|wav)$', re.IGNORECASE)
+NOISE_PATTERN = re.compile(
+    r'\(.*?official.*?video.*?\)|\[.*?official.*?video.*?\]|'
+    r'\(.*?lyric.*?video.*?\)|\[.*?video.*?\]|'
+    r'\(.*?audio.*?\)|\[.*?4k.*?\]|\|.*|\d+kbps|'
+    r'\(.*?\d{4}.*?\)',
+    re.IGNORECASE
+)
+HIDDEN_ARTIST_PATTERN = re.compile(r"various|unknown|va -", re.IGNORECASE)
+
+def clean_title(title):
+    if not title: return "Unknown Title"
+    title = EXTENSION_PATTERN.sub('', title)
+    return NOISE_PATTERN.sub('', title).strip()
+
+def duration_bucket(seconds):
+    """Matches the /songs 'listen' filter: Short < 3 min, Mid 3-5 min, Long > 5 min."""
+    if not isinstance(seconds, (int, float)):
+        return None
+    return get_duration_category(seconds)
+
+def _facet_values(value):
+    """Lowercased values a regex filter could match (arrays match per element)."""
+    if value is None:
+        return ()
+    if isinstance(value, list):
+        return tuple(str(v).lower() for v in value)
+    return (str(value).lower(),)
+
+def _sort_part(value):
+    # MongoDB orders missing/null before any string, and sorts an array
+    # ascending by its smallest element (an empty array counts as null here)
+    if isinstance(value, list):
+        value = min((str(v) for v in value if v is not None), default=None)
+    return (0, "") if value is None else (1, str(value))
+
+def iter_bits(mask):
+    """Yields set bit positions of an int bitmap in ascending order."""
+    # bin() is linear and C-speed; peeling bits off a large int one by one is not
+    bits = bin(mask)[:1:-1]
+    pos = bits.find("1")
+    while pos != -1:
+        yield pos
+        pos = bits.find("1", pos + 1)
+
+def mask_from_positions(positions):
+    """Builds an int bitmap from bit positions in one pass."""
+    buf = bytearray()
+    for pos in positions:
+        byte = pos >> 3
+        if byte >= len(buf):
+            buf.extend(bytes(byte - len(buf) + 1))
+        buf[byte] |= 1 << (pos & 7)
+    return int.from_bytes(buf, "little")
+
+def encode_cursor(payload):
+    """Opaque, URL-safe continuation token."""
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; raises ValueError on anything malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(payload, dict) or not ("k" in payload or "o" in payload):
+        raise ValueError("Invalid cursor")
+    if "o" in payload and (not isinstance(payload["o"], int) or payload["o"] < 0):
+        raise ValueError("Invalid cursor")
+    return payload
+
+def cursor_sort_key(payload):
+    """Rebuilds the (genre, title, _id) sort key carried by a keyset cursor."""
+    try:
+        genre, title, _id = payload["k"]
+        return ((genre[0], genre[1]), (title[0], title[1]), _id)
+    except (KeyError, TypeError, ValueError, IndexError) as e:
+        raise ValueError("Invalid cursor") from e
+
+def sort_key_for(doc):
+    """The (genre, title, _id) ordering key /songs pages by."""
+    return (_sort_part(doc.get("genre")), _sort_part(doc.get("title")), doc["_id"])
+
+def keyset_filter(sort_key):
+    """MongoDB clause selecting documents strictly after `sort_key` in (genre, title, _id) order."""
+    (genre_rank, genre), (title_rank, title), _id = sort_key
+    genre = genre if genre_rank else None
+    title = title if title_rank else None
+
+    # A plain $gt/$eq matches an array if any element does, but the array
+    # sorts by its smallest element, so each bound also excludes smaller ones
+    def after(field, value):
+        # Anything non-null sorts after null/missing
+        if value is None:
+            return {field: {"$ne": None}}
+        return {field: {"$gt": value, "$not": {"$lte": value}}}
+
+    def equal(field, value):
+        if value is None:
+            return {field: None}
+        return {field: {"$eq": value, "$not": {"$lt": value}}}
+
+    return {"$or": [
+        after("genre", genre),
+        {"$and": [equal("genre", genre), after("title", title)]},
+        {"$and": [equal("genre", genre), equal("title", title), {"_id": {"$gt": _id}}]}
+    ]}
+
+class SongRecord:
+    """Compact, precomputed view of one master_library document."""
+    __slots__ = ("id", "sort_key", "visible", "genres", "moods", "languages",
+                 "bucket", "search_fields", "updated_at", "payload")
+
+    def __init__(self, doc):
+        self.id = doc["_id"]
+        genre = doc.get("genre")
+        title = doc.get("title")
+        artist = doc.get("artist")
+        self.sort_key = sort_key_for(doc)
+        self.visible = doc.get("is_hidden") is not True and not (
+            isinstance(artist, str) and HIDDEN_ARTIST_PATTERN.search(artist)
+        )
+        self.genres = _facet_values(genre)
+        self.moods = _facet_values(doc.get("mood"))
+        self.languages = _facet_values(doc.get("language"))
+        self.bucket = duration_bucket(doc.get("duration_seconds"))
+        self.updated_at = doc.get("updated_at")
+        self.payload = {
+            "id": str(self.id),
+            "title": clean_title(title),
+            "artist": artist or "Unknown Artist",
+            "album_art": doc.get("album_art") or "https://placehold.co/300",
+            "msg_id": self.id,
+            "duration": doc.get("duration", "0:00"),
+            "duration_seconds": doc.get("duration_seconds", 0),
+            "genre": str(doc.get("genre", "Unknown")),
+            "mood": str(doc.get("mood", "Unknown")),
+            "language": str(doc.get("language", "Unknown")),
+            "is_playable": True
+        }
+        self.search_fields = (self.payload["title"], artist if isinstance(artist, str) else "")
+
+class CatalogIndex:
+    """
+    Immutable-order snapshot of the catalog.
+    Records are presorted by (genre, title, _id); every filter value maps to
+    an int bitmap over those positions, so a /songs query is a handful of
+    bitwise ANDs followed by reading the first set bits in order.
+    """
+    def __init__(self, records):
+        self.records = sorted(records, key=lambda r: r.sort_key)
+        self.sort_keys = [r.sort_key for r in self.records]
+        self.positions = {}
+        self.visible = 0
+        self.genre = {}
+        self.mood = {}
+        self.language = {}
+        self.bucket = {}
+
+        postings = {"visible": [], "genre": {}, "mood": {}, "language": {}, "bucket": {}}
+        for pos, record in enumerate(self.records):
+            self.positions[record.id] = pos
+            if record.visible:
+                postings["visible"].append(pos)
+            for field, values in (("genre", record.genres), ("mood", record.moods),
+                                  ("language", record.languages)):
+                for value in values:
+                    postings[field].setdefault(value, []).append(pos)
+            if record.bucket:
+                postings["bucket"].setdefault(record.bucket, []).append(pos)
+
+        self.visible = mask_from_positions(postings["visible"])
+        for field in ("genre", "mood", "language", "bucket"):
+            setattr(self, field, {
+                value: mask_from_positions(positions)
+                for value, positions in postings[field].items()
+            })
+        self.search = SearchIndex(self.records)
+
+    def _set_bits(self, record, bit):
+        if record.visible:
+            self.visible |= bit
+        for postings, values in ((self.genre, record.genres), (self.mood, record.moods),
+                                 (self.language, record.languages)):
+            for value in values:
+                postings[value] = postings.get(value, 0) | bit
+        if record.bucket:
+            self.bucket[record.bucket] = self.bucket.get(record.bucket, 0) | bit
+
+    def _clear_bits(self, record, bit):
+        self.visible &= ~bit
+        for postings, values in ((self.genre, record.genres), (self.mood, record.moods),
+                                 (self.language, record.languages)):
+            for value in values:
+                postings[value] &= ~bit
+        if record.bucket:
+            self.bucket[record.bucket] &= ~bit
+
+    def replace(self, record):
+        """
+        Swaps a record in place when its sort position is unchanged.
+        Returns False when the caller has to rebuild the index instead.
+        """
+        pos = self.positions.get(record.id)
+        if pos is None:
+            return False
+        current = self.records[pos]
+        if current.sort_key != record.sort_key or current.search_fields != record.search_fields:
+            return False
+        bit = 1 << pos
+        self._clear_bits(current, bit)
+        self.records[pos] = record
+        self._set_bits(record, bit)
+        return True
+
+    @staticmethod
+    def _substring_mask(postings, needle):
+        """Case-insensitive 'contains' over the few distinct facet values."""
+        needle = needle.lower()
+        mask = 0
+        for value, bits in postings.items():
+            if needle in value:
+                mask |= bits
+        return mask
+
+    def filter_mask(self, genre='all', mood='all', listen='all', language='all'):
+        mask = self.visible
+        if genre and genre.lower() != 'all':
+            mask &= self._substring_mask(self.genre, genre)
+        if mood and mood.lower() != 'all':
+            mask &= self._substring_mask(self.mood, mood)
+        if language and language.lower() != 'all':
+            mask &= self._substring_mask(self.language, language)
+        if listen and listen.lower() != 'all' and listen in ("Short", "Mid", "Long"):
+            mask &= self.bucket.get(listen, 0)
+        return mask
+
+    def facets(self, search=None, genre='all', mood='all', listen='all', language='all'):
+        """
+        Per-value counts for every filter, given the other active filters.
+        Each facet ignores its own selection (so sibling options keep their
+        counts), and a value's count is what selecting it would return,
+        including the substring matching the filters use.
+        """
+        base = self.visible
+        if search and search.strip():
+            base &= mask_from_positions(self.search.search(search, self.visible))
+        selected = {"genre": genre, "mood": mood, "listen": listen, "language": language}
+        masks = {
+            field: self.filter_mask(**{f: v if f != field else 'all' for f, v in selected.items()}) & base
+            for field in selected
+        }
+
+        result = {"total": (self.filter_mask(genre, mood, listen, language) & base).bit_count()}
+        for field, postings in (("genre", self.genre), ("mood", self.mood), ("language", self.language)):
+            context = masks[field]
+            counts = []
+            for value in postings:
+                count = (context & self._substring_mask(postings, value)).bit_count()
+                if count:
+                    counts.append({"value": value, "count": count})
+            counts.sort(key=lambda c: (-c["count"], c["value"]))
+            result[field] = counts
+        result["listen"] = [
+            {"value": bucket, "count": (masks["listen"] & self.bucket.get(bucket, 0)).bit_count()}
+            for bucket in ("Short", "Mid", "Long")
+        ]
+        return result
+
+    def query(self, search=None, genre='all', mood='all', listen='all', language='all',
+              limit=100, skip=0, cursor=None):
+        """
+        Filtered page of payloads plus the cursor for the next page.
+        Plain browsing follows (genre, title, _id) order and pages by keyset:
+        the cursor carries the last sort key, so page 50 costs the same as
+        page 1 and does not shift when songs are added. A search ranks by
+        relevance instead and its cursor carries the rank offset. Cursors
+        issued by the warm-up fallback (see FALLBACK_CURSOR) are rejected:
+        their offsets count a different match set in a different order.
+        """
+        if cursor and cursor.get("src") == FALLBACK_CURSOR:
+            raise ValueError("Invalid cursor")
+        mask = self.filter_mask(genre, mood, listen, language)
+        if search and search.strip():
+            if cursor and "k" in cursor:
+                # A keyset position means nothing in relevance order
+                raise ValueError("Invalid cursor")
+            ranked = self.search.search(search, mask)
+            start = cursor["o"] if cursor and "o" in cursor else skip
+            page = ranked[start:start + limit]
+            next_cursor = encode_cursor({"o": start + limit}) if start + limit < len(ranked) else None
+            return [self.records[pos].payload for pos in page], next_cursor
+
+        if cursor and "k" in cursor:
+            # Drop every position at or before the last record already served
+            try:
+                start = bisect_right(self.sort_keys, cursor_sort_key(cursor))
+            except TypeError as e:
+                raise ValueError("Invalid cursor") from e
+            mask &= ~((1 << start) - 1)
+            skip = 0
+
+        page = []
+        has_more = False
+        for i, pos in enumerate(iter_bits(mask)):
+            if i < skip:
+                continue
+            if len(page) >= limit:
+                has_more = True
+                break
+            page.append(pos)
+
+        next_cursor = None
+        if has_more and page:
+            next_cursor = encode_cursor({"k": self.sort_keys[page[-1]]})
+        return [self.records[pos].payload for pos in page], next_cursor
+
+    def suggest(self, prefix, limit=8):
+        """As-you-type lookup: best matching visible songs plus word completions."""
+        ranked = self.search.search(prefix, self.visible)
+        return {
+            "results": [
+                {key: self.records[pos].payload[key] for key in ("id", "title", "artist", "msg_id", "album_art")}
+                for pos in ranked[:limit]
+            ],
+            "completions": self.search.completions(prefix)
+        }
+
+class Catalog:
+    """
+    Keeps an in-process CatalogIndex of master_library up to date.
+    Changes arrive from a change stream when the deployment supports it,
+    otherwise from polling `updated_at` (which every writer in the repo
+    stamps) plus a full reload every `full_reload_interval` seconds to catch
+    anything written by hand. Snapshots are built on a worker thread so a
+    rebuild never stalls open streams, and `version` only moves when the
+    catalog actually changed, keeping the response cache warm.
+    """
+    def __init__(self, collection, poll_interval=30, full_reload_interval=600):
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self.full_reload_interval = full_reload_interval
+        self.index = None
+        self.version = 0
+        self._records = {}
+        self._watermark = None
+        self._loaded_at = 0
+
+    @property
+    def ready(self):
+        return self.index is not None
+
+    async def load(self):
+        started = time.monotonic()
+        docs = [doc async for doc in self.collection.find({}, PROJECTION)]
+        built = await asyncio.to_thread(self._build, docs, self._records if self.ready else None)
+        self._loaded_at = time.monotonic()
+        if built is None:
+            logger.debug("📚 Full reload found no changes")
+            return
+        records, index = built
+        self._records = records
+        self._swap(index)
+        self._watermark = max(
+            (r.updated_at for r in records.values() if r.updated_at is not None), default=None
+        )
+        logger.info("📚 Catalog loaded: %s songs in %.2fs", len(records), time.monotonic() - started)
+
+    @staticmethod
+    def _build(docs, previous=None):
+        """
+        Runs off the event loop. Returns (records, CatalogIndex), or None when
+        the documents describe exactly the catalog in `previous`.
+        """
+        records = {}
+        for doc in docs:
+            records[doc["_id"]] = SongRecord(doc)
+        if previous is not None and records.keys() == previous.keys() and all(
+            (r.sort_key, r.visible, r.payload) == (previous[_id].sort_key, previous[_id].visible, previous[_id].payload)
+            for _id, r in records.items()
+        ):
+            return None
+        return records, CatalogIndex(records.values())
+
+    def _swap(self, index):
+        self.index = index
+        self.version += 1
+
+    async def apply(self, docs=(), deleted_ids=()):
+        """
+        Folds changed documents into the index. In-place edits patch the live
+        snapshot; inserts, deletes and re-sorts rebuild it on a worker thread.
+        """
+        rebuild = bool(deleted_ids)
+        for _id in deleted_ids:
+            self._records.pop(_id, None)
+        for doc in docs:
+            record = SongRecord(doc)
+            self._records[record.id] = record
+            if record.updated_at is not None and (self._watermark is None or record.updated_at > self._watermark):
+                self._watermark = record.updated_at
+            if not rebuild and not self.index.replace(record):
+                rebuild = True
+        if rebuild:
+            self._swap(await asyncio.to_thread(CatalogIndex, list(self._records.values())))
+        elif docs or deleted_ids:
+            self.version += 1
+
+    async def run(self):
+        """Background task: initial load, then follow changes until cancelled."""
+        while not self.ready:
+            try:
+                await self.load()
+            except PyMongoError as e:
+                logger.error("❌ Catalog load failed, retrying: %s", e)
+                await asyncio.sleep(5)
+        while True:
+            try:
+                await self._follow_change_stream()
+            except PyMongoError as e:
+                logger.info("📚 Change stream unavailable (%s); polling updated_at instead", e)
+                break
+        await self._poll()
+
+    async def _follow_change_stream(self):
+        async with self.collection.watch(full_document="updateLookup") as stream:
+            docs, deleted = [], []
+            while True:
+                change = await stream.try_next()
+                if change is None:
+                    # Stream is idle: flush what accumulated as one batch
+                    if docs or deleted:
+                        await self.apply(docs, deleted)
+                        docs, deleted = [], []
+                    continue
+                if change["operationType"] == "delete":
+                    deleted.append(change["documentKey"]["_id"])
+                elif change.get("fullDocument"):
+                    docs.append(change["fullDocument"])
+                elif change["operationType"] in ("drop", "rename", "invalidate"):
+                    await self.load()
+                    return
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if time.monotonic() - self._loaded_at >= self.full_reload_interval:
+                    await self.load()
+                    continue
+                # Until some song carries a stamp, any stamped document is new
+                since = {"$gt": self._watermark} if self._watermark is not None else {"$ne": None}
+                docs = [doc async for doc in self.collection.find({"updated_at": since}, PROJECTION)]
+                if docs:
+                    await self.apply(docs)
+                    logger.debug("📚 Catalog refreshed %s changed songs", len(docs))
+            except PyMongoError as e:
+                logger.error("❌ Catalog refresh failed: %s", e)
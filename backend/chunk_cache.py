@@ -0,0 +1,199 @@
+import os
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger("ChunkCache")
+
+class ChunkCache:
+    """
+    Content-addressed on-disk cache for audio chunks.
+    Keys are (channel_id, msg_id, chunk_offset) tuples, hashed into a sharded
+    file layout. The cache is capped at `max_bytes` and evicts least recently
+    used chunks first. Concurrent misses on the same chunk share one download.
+
+    With `shared=True` several worker processes use the same directory (and,
+    through the OS page cache, the same memory): misses first look for a file
+    a sibling wrote, and only the process given `owns_disk` deletes files.
+    It rebuilds the LRU from mtimes, which every reader bumps, in rescan().
+    """
+    def __init__(self, root, max_bytes, shared=False):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.enabled = max_bytes > 0
+        self.shared = shared
+        self.owns_disk = not shared
+        self._index = OrderedDict()  # digest -> size, oldest first
+        self._total_bytes = 0
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.bytes_served = 0
+        self.bytes_filled = 0
+        self.adopted = 0
+        if self.enabled:
+            self._load_index()
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.sha1(":".join(str(part) for part in key).encode()).hexdigest()
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], f"{digest}.chunk")
+
+    def _scan(self):
+        """(mtime, digest, size) for every chunk on disk, oldest first."""
+        os.makedirs(self.root, exist_ok=True)
+        entries = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".chunk"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue  # evicted by a sibling mid-scan
+                    entries.append((stat.st_mtime, entry.name[:-len(".chunk")], stat.st_size))
+        return sorted(entries)
+
+    def _rebuild(self, entries):
+        self._index = OrderedDict((digest, size) for _, digest, size in entries)
+        self._total_bytes = sum(size for _, _, size in entries)
+        self._evict()
+
+    def _load_index(self):
+        """Rebuilds the LRU index from disk, treating file mtime as last access."""
+        self._rebuild(self._scan())
+        logger.info("📀 Chunk cache loaded: %s chunks, %s MB", len(self._index), self._total_bytes // (1024 * 1024))
+
+    async def rescan(self):
+        """Re-reads the directory so chunks and reads from sibling processes count."""
+        if self.enabled:
+            self._rebuild(await asyncio.to_thread(self._scan))
+
+    async def run_janitor(self, interval=60):
+        """Background task for the disk owner in shared mode: enforce the cap box-wide."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.rescan()
+            except OSError as e:
+                logger.error("⚠️ Chunk cache rescan failed: %s", e)
+
+    def _read(self, digest):
+        path = self._path(digest)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Bump mtime so the LRU order survives a restart
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def _write(self, digest, data):
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _remove(self, digest):
+        try:
+            os.remove(self._path(digest))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._index:
+            digest, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            # Non-owners only forget the entry; the owner deletes the file
+            if self.owns_disk:
+                self.evictions += 1
+                self._remove(digest)
+
+    async def get_or_fetch(self, key, fetch):
+        """
+        Returns the chunk for `key`, reading it from disk when cached.
+        On a miss `fetch()` is awaited once, even if several streams ask for
+        the same chunk at the same time, and the result is written to disk.
+        """
+        if not self.enabled:
+            return await fetch()
+
+        digest = self._digest(key)
+        known = digest in self._index
+        if known or (self.shared and digest not in self._inflight):
+            data = await asyncio.to_thread(self._read, digest)
+            if data is not None:
+                if digest not in self._index:
+                    # Written by a sibling worker process
+                    self.adopted += 1
+                    self._index[digest] = len(data)
+                    self._total_bytes += len(data)
+                self._index.move_to_end(digest)
+                self.hits += 1
+                self.bytes_served += len(data)
+                self._evict()
+                return data
+            # File vanished underneath us, forget it and refetch
+            self._total_bytes -= self._index.pop(digest, 0)
+
+        pending = self._inflight.get(digest)
+        if pending:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        # The fill runs as its own task so a listener disconnecting mid-chunk
+        # does not cancel the download other streams are waiting on.
+        task = asyncio.create_task(self._fill(digest, fetch))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._inflight[digest] = task
+        return await asyncio.shield(task)
+
+    async def _fill(self, digest, fetch):
+        try:
+            data = await fetch()
+            if data:
+                await self._store(digest, data)
+            return data
+        finally:
+            self._inflight.pop(digest, None)
+
+    async def _store(self, digest, data):
+        try:
+            await asyncio.to_thread(self._write, digest, data)
+        except OSError as e:
+            logger.error("⚠️ Chunk cache write failed: %s", e)
+            return
+        previous = self._index.pop(digest, 0)
+        self._index[digest] = len(data)
+        self._total_bytes += len(data) - previous
+        self.bytes_filled += len(data)
+        self._evict()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "chunks": len(self._index),
+            "size_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "bytes_served": self.bytes_served,
+            "bytes_filled": self.bytes_filled,
+            "evictions": self.evictions,
+            "shared": self.shared,
+            "adopted": self.adopted,
+            "inflight": len(self._inflight)
+        }
@@ -0,0 +1,109 @@
+import re
+from functools import lru_cache
+
+# Genre keyword -> mood heuristics shared by the repair/ingest scripts and the API
+MOOD_MAP = {
+    "Happy": ["Pop", "Disco", "Ska", "Reggae", "Funk", "Joy", "Upbeat"],
+    "Sad": ["Blues", "Sentimental", "Tragedy", "Sad", "Heartbreak"],
+    "Chill": ["Lo-Fi", "Jazz", "Classical", "Folk", "Acoustic", "Ambient", "Slow"],
+    "Energetic": ["Rock", "Metal", "Electronic", "House", "Techno", "Hip-Hop", "Dance", "Workout"],
+    "Romantic": ["Bollywood", "R&B", "Soul", "Love", "Romance"],
+    "Focus": ["Instrumental", "Soundtrack", "Study", "Concentration"],
+    "Party": ["Club", "Latin", "Salsa", "Bhangra", "Party"]
+}
+DEFAULT_MOOD = "Happy"
+
+# When a genre matches several moods the earliest one here wins. Happy is also
+# the fallback, so any more specific mood beats it.
+MOOD_PRIORITY = ("Sad", "Chill", "Energetic", "Romantic", "Focus", "Party", "Happy")
+
+# Duration buckets used by the 'listen' filter: Short < 3 min, Mid 3-5 min, Long > 5 min
+SHORT_MAX_SECONDS = 180
+MID_MAX_SECONDS = 300
+DURATION_FILTERS = {
+    "Short": {"$lt": SHORT_MAX_SECONDS},
+    "Mid": {"$gte": SHORT_MAX_SECONDS, "$lte": MID_MAX_SECONDS},
+    "Long": {"$gt": MID_MAX_SECONDS},
+}
+
+NON_ALNUM_PATTERN = re.compile(r'[^a-z0-9]')
+DURATION_PATTERN = re.compile(r'\s*(?:(\d+):)?(\d+):(\d+)\s*')
+
+def _build_mood_matcher():
+    keyword_rank = {}
+    for rank, mood in enumerate(MOOD_PRIORITY):
+        for keyword in MOOD_MAP[mood]:
+            keyword_rank.setdefault(keyword.lower(), rank)
+    # Alternatives in priority order; the lookahead reports a match at every
+    # position, so overlapping keywords are all seen in a single scan
+    ordered = sorted(keyword_rank, key=keyword_rank.get)
+    pattern = re.compile("(?=(" + "|".join(map(re.escape, ordered)) + "))")
+    return pattern, keyword_rank
+
+MOOD_PATTERN, KEYWORD_RANK = _build_mood_matcher()
+
+def normalize_text(text):
+    """
+    Strict normalization for accurate matching.
+    'The  Beatles!!!' -> 'thebeatles'
+    """
+    if not text: return ""
+    return NON_ALNUM_PATTERN.sub('', str(text).lower())
+
+@lru_cache(maxsize=4096)
+def _mood_for(genre_lower):
+    best = len(MOOD_PRIORITY)
+    for match in MOOD_PATTERN.finditer(genre_lower):
+        best = min(best, KEYWORD_RANK[match.group(1)])
+        if best == 0:
+            break
+    return MOOD_PRIORITY[best] if best < len(MOOD_PRIORITY) else DEFAULT_MOOD
+
+def infer_mood(genre):
+    """Mood for a genre string; memoized, since a library has few distinct genres."""
+    return _mood_for(str(genre).lower())
+
+@lru_cache(maxsize=4096)
+def _parse_duration_string(text):
+    match = DURATION_PATTERN.fullmatch(text)
+    if not match:
+        return 0
+    hours, minutes, seconds = match.groups()
+    return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+
+def parse_duration_to_seconds(d_val):
+    """
+    Handles integers (seconds) and strings ("MM:SS" / "HH:MM:SS").
+    Anything else, or a malformed string, yields 0.
+    """
+    if isinstance(d_val, bool):
+        return 0
+    if isinstance(d_val, (int, float)):
+        return int(d_val)
+    if isinstance(d_val, str):
+        return _parse_duration_string(d_val)
+    return 0
+
+def get_duration_category(seconds):
+    if seconds < SHORT_MAX_SECONDS: return "Short"
+    if seconds <= MID_MAX_SECONDS: return "Mid"
+    return "Long"
+
+def parse_durations(values):
+    """Batch form of parse_duration_to_seconds: each distinct value is parsed once."""
+    seen = {}
+    out = []
+    for value in values:
+        key = (type(value), value) if value.__hash__ else None
+        if key is None:
+            out.append(parse_duration_to_seconds(value))
+            continue
+        seconds = seen.get(key)
+        if seconds is None:
+            seconds = seen[key] = parse_duration_to_seconds(value)
+        out.append(seconds)
+    return out
+
+def duration_categories(seconds_list):
+    """Batch form of get_duration_category; non-positive durations map to None."""
+    return [get_duration_category(s) if s > 0 else None for s in seconds_list]
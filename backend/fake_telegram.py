@@ -0,0 +1,101 @@
+import random
+import asyncio
+from telethon import errors, types
+
+class FakeNetwork:
+    """
+    Shared knobs for every fake bot: per-request latency, per-connection
+    bandwidth and the probability that a download raises FloodWait.
+    """
+    def __init__(self, latency=0.05, bandwidth=8 * 1024 * 1024, flood_rate=0.0,
+                 flood_seconds=2, file_size=4 * 1024 * 1024, seed=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.file_size = file_size
+        self.random = random.Random(seed)
+        # One synthetic "audio" block sliced for every chunk; content is irrelevant
+        self._block = bytes(range(256)) * 4096
+        self.requests = 0
+        self.floods = 0
+        self.bytes_served = 0
+
+    async def delay(self, nbytes=0):
+        await asyncio.sleep(self.latency + (nbytes / self.bandwidth if self.bandwidth else 0))
+
+    def maybe_flood(self):
+        if self.flood_rate and self.random.random() < self.flood_rate:
+            self.floods += 1
+            raise errors.FloodWaitError(request=None, capture=self.flood_seconds)
+
+    def chunk(self, offset, size):
+        out = bytearray()
+        while len(out) < size:
+            start = (offset + len(out)) % len(self._block)
+            out += self._block[start:start + size - len(out)]
+        return bytes(out)
+
+class _FakeDocument:
+    def __init__(self, msg_id, size, duration):
+        self.id = msg_id
+        self.dc_id = 2
+        self.access_hash = msg_id * 7919
+        self.file_reference = b"fake-ref"
+        self.size = size
+        self.mime_type = "audio/mpeg"
+        self.attributes = [types.DocumentAttributeAudio(duration=duration)]
+
+class _FakeMessage:
+    def __init__(self, msg_id, size):
+        self.id = msg_id
+        self.document = _FakeDocument(msg_id, size, duration=size // 16000)
+
+class FakeTelegramClient:
+    """
+    Stand-in for telethon.TelegramClient covering what BotWorker/ChunkSource use:
+    start, is_connected, disconnect, get_messages and iter_download.
+    Every message id resolves to an audio document of `network.file_size` bytes.
+    """
+    def __init__(self, session, api_id, api_hash, network=None):
+        self.session = session
+        self.network = network or FakeNetwork()
+        self._connected = False
+
+    async def start(self, bot_token=None):
+        await self.network.delay()
+        self._connected = True
+        return self
+
+    def is_connected(self):
+        return self._connected
+
+    async def disconnect(self):
+        self._connected = False
+
+    async def get_messages(self, entity, ids=None):
+        await self.network.delay()
+        self.network.requests += 1
+        if isinstance(ids, (list, tuple)):
+            return [_FakeMessage(i, self.network.file_size) for i in ids]
+        return _FakeMessage(ids, self.network.file_size)
+
+    async def iter_download(self, location, offset=0, limit=None, request_size=512 * 1024,
+                            file_size=None, dc_id=None):
+        size = file_size or self.network.file_size
+        served = 0
+        while offset < size and (limit is None or served < limit):
+            self.network.requests += 1
+            self.network.maybe_flood()
+            length = min(request_size, size - offset)
+            await self.network.delay(length)
+            self.network.bytes_served += length
+            yield self.network.chunk(offset, length)
+            offset += length
+            served += 1
+
+def fake_client_factory(network):
+    """A BotManager client_factory producing FakeTelegramClients on `network`."""
+    def build(session, api_id, api_hash):
+        return FakeTelegramClient(session, api_id, api_hash, network=network)
+    return build
@@ -1,76 +1,46 @@
 import json
 import os
-import re
 import pymongo
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+from bson import json_util
 from dotenv import load_dotenv
+from classifier import duration_categories, infer_mood, normalize_text, parse_durations
 
 # 1. Setup & Config
 load_dotenv()
 MONGO_URL = os.getenv("MONGO_URL")
 DB_NAME = os.getenv("DB_NAME", "music_app_pro")
+BATCH_SIZE = int(os.getenv("REPAIR_BATCH_SIZE", "1000"))
+CHECKPOINT_FILE = os.getenv("REPAIR_CHECKPOINT", "repair_checkpoint.json")
 
-# 2. Heuristic Maps (Fallback Logic)
-MOOD_MAP = {
-    "Happy": ["Pop", "Disco", "Ska", "Reggae", "Funk", "Joy", "Upbeat"],
-    "Sad": ["Blues", "Sentimental", "Tragedy", "Sad", "Heartbreak"],
-    "Chill": ["Lo-Fi", "Jazz", "Classical", "Folk", "Acoustic", "Ambient", "Slow"],
-    "Energetic": ["Rock", "Metal", "Electronic", "House", "Techno", "Hip-Hop", "Dance", "Workout"],
-    "Romantic": ["Bollywood", "R&B", "Soul", "Love", "Romance"],
-    "Focus": ["Instrumental", "Soundtrack", "Study", "Concentration"],
-    "Party": ["Club", "Latin", "Salsa", "Bhangra", "Party"]
+# Only the fields the repair reads or may rewrite
+PROJECTION = {
+    "title": 1, "artist": 1, "genre": 1, "duration": 1,
+    "duration_seconds": 1, "duration_category": 1, "mood": 1, "is_hidden": 1
 }
 
-def normalize_text(text):
-    """
-    Strict normalization for accurate matching.
-    'The  Beatles!!!' -> 'thebeatles'
-    """
-    if not text: return ""
-    # Lowercase, remove special chars, remove spaces
-    return re.sub(r'[^a-z0-9]', '', str(text).lower())
-
-def parse_duration_to_seconds(d_val):
-    """
-    Robust duration parser. Handles integers (seconds) and strings ("MM:SS").
-    """
-    if isinstance(d_val, (int, float)):
-        return int(d_val)
-    
-    if isinstance(d_val, str):
-        d_val = d_val.strip()
-        try:
-            parts = d_val.split(':')
-            if len(parts) == 2: # MM:SS
-                return int(parts[0]) * 60 + int(parts[1])
-            elif len(parts) == 3: # HH:MM:SS
-                return int(parts[0]) * 3600 + int(parts[1]) * 60 + int(parts[2])
-        except:
-            pass
-    return 0
-
-def get_duration_category(seconds):
-    if seconds < 180: return "Short"      # < 3 min
-    if seconds <= 300: return "Mid"       # 3-5 min
-    return "Long"                         # > 5 min
-
-def run_pro_fix():
-    print("🚀 INITIALIZING PROFESSIONAL REPAIR SYSTEM...")
-    
-    # --- STEP 1: CONNECT TO DB ---
+def load_checkpoint(path):
+    """Returns (last_id, stats) from an interrupted run, or (None, None)."""
     try:
-        client = pymongo.MongoClient(MONGO_URL)
-        db = client[DB_NAME]
-        col = db.master_library
-        total_songs = col.count_documents({})
-        print(f"✅ DB Connected. Scanning {total_songs} songs.")
-    except Exception as e:
-        print(f"❌ DB Connection Failed: {e}")
-        return
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json_util.loads(f.read())
+        return data["last_id"], data["stats"]
+    except FileNotFoundError:
+        return None, None
 
-    # --- STEP 2: LOAD JSON REFERENCE (The "Source of Truth") ---
+def save_checkpoint(path, last_id, stats):
+    # Write-then-rename so a crash mid-write never leaves a corrupt checkpoint
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(json_util.dumps({"last_id": last_id, "stats": stats}))
+    os.replace(tmp, path)
+
+def load_reference(path='../duration_fix.json'):
+    """Indexes the JSON reference by normalized 'title|artist' signature."""
     json_lookup = {}
     try:
-        with open('../duration_fix.json', 'r', encoding='utf-8') as f:
+        with open(path, 'r', encoding='utf-8') as f:
             raw_data = json.load(f)
             # Handle if JSON is list or dict wrapper
             source_list = raw_data.get('results', raw_data) if isinstance(raw_data, dict) else raw_data
@@ -93,74 +63,42 @@ def run_pro_fix():
             print(f"✅ Indexed {len(json_lookup)} unique signatures from JSON.")
     except FileNotFoundError:
         print("⚠️ 'duration_fix.json' not found. Skipping JSON enrichment (using Heuristics only).")
-
-    # --- STEP 3: THE FIX LOOP ---
-    print("\n🛠️ STARTING BATCH PROCESSING...")
-    
-    cursor = col.find({})
-    stats = {
-        "json_match": 0,
-        "heuristic_fix": 0,
-        "various_hidden": 0,
-        "processed": 0
-    }
-
-    batch_updates = []
-    
-    for song in cursor:
+    return json_lookup
+
+def plan_updates(songs, json_lookup, stats):
+    """Computes the repaired fields for a batch of songs (before diffing)."""
+    # A/B/C. Identity, signature and JSON reference for every song
+    refs = [
+        json_lookup.get(f"{normalize_text(song.get('title', ''))}|{normalize_text(song.get('artist', ''))}") or {}
+        for song in songs
+    ]
+
+    # --- 1. DURATION LOGIC ---
+    # JSON first, falling back to the current DB value; parsed once per distinct value
+    ref_seconds = parse_durations([ref.get('duration') for ref in refs])
+    db_seconds = parse_durations([song.get('duration') for song in songs])
+    final_seconds = [ref_sec or db_sec for ref_sec, db_sec in zip(ref_seconds, db_seconds)]
+    categories = duration_categories(final_seconds)
+
+    planned = []
+    for song, ref_data, seconds, category in zip(songs, refs, final_seconds, categories):
         updates = {}
-        
-        # A. Identity Extraction
-        db_title = song.get('title', '')
-        db_artist = song.get('artist', '')
-        
-        # B. Generate Signature
-        signature = f"{normalize_text(db_title)}|{normalize_text(db_artist)}"
-        
-        # C. Strategy Selection
-        ref_data = json_lookup.get(signature)
-        
-        # --- 1. DURATION LOGIC ---
-        final_duration_sec = 0
-        
-        # Try JSON first
-        if ref_data and ref_data.get('duration'):
-            final_duration_sec = parse_duration_to_seconds(ref_data['duration'])
-        
-        # Fallback to DB current value
-        if final_duration_sec == 0:
-            final_duration_sec = parse_duration_to_seconds(song.get('duration'))
-            
-        if final_duration_sec > 0:
-            updates['duration_seconds'] = final_duration_sec
-            updates['duration_category'] = get_duration_category(final_duration_sec)
+        if seconds > 0:
+            updates['duration_seconds'] = seconds
+            updates['duration_category'] = category
 
         # --- 2. MOOD LOGIC ---
-        final_mood = "all"
-        
-        # Try JSON first
-        if ref_data and ref_data.get('mood') and ref_data['mood'].lower() != "all":
-            final_mood = ref_data['mood']
+        # Try JSON first, then the genre heuristic
+        if ref_data.get('mood') and ref_data['mood'].lower() != "all":
+            updates['mood'] = ref_data['mood']
             stats["json_match"] += 1
         else:
-            # Fallback to Heuristic (Genre Mapping)
-            genre_str = str(song.get('genre', '')).lower()
-            inferred = "Happy" # Default
-            
-            for m_key, keywords in MOOD_MAP.items():
-                for k in keywords:
-                    if k.lower() in genre_str:
-                        inferred = m_key
-                        break
-                if inferred != "Happy": break
-            
-            final_mood = inferred
+            updates['mood'] = infer_mood(song.get('genre', ''))
             stats["heuristic_fix"] += 1
 
-        updates['mood'] = final_mood
-
         # --- 3. CLEANUP LOGIC ---
         # Hide "Various Artists" or empty artists
+        db_artist = song.get('artist', '')
         a_lower = db_artist.lower()
         if "various artists" in a_lower or "unknown" in a_lower or not db_artist.strip():
             updates['is_hidden'] = True
@@ -168,21 +106,88 @@ def run_pro_fix():
         else:
             updates['is_hidden'] = False
 
-        # D. Queue Update
-        if updates:
-            col.update_one({"_id": song["_id"]}, {"$set": updates})
+        planned.append(updates)
+    return planned
+
+def queue_changes(songs, json_lookup, stats):
+    """UpdateOne ops for the fields that actually change in this batch."""
+    ops = []
+    # Stamped so the backend catalog poll and incremental backups see the repair
+    now = datetime.now(timezone.utc)
+    for song, updates in zip(songs, plan_updates(songs, json_lookup, stats)):
+        changed = {field: value for field, value in updates.items() if song.get(field) != value}
+        if changed:
+            ops.append(UpdateOne({"_id": song["_id"]}, {"$set": {**changed, "updated_at": now}}))
+        else:
+            stats["unchanged"] += 1
+    stats["processed"] += len(songs)
+    return ops
+
+def flush_batch(col, songs, json_lookup, stats):
+    ops = queue_changes(songs, json_lookup, stats)
+    if ops:
+        result = col.bulk_write(ops, ordered=False)
+        stats["written"] += result.modified_count
+
+def run_pro_fix(batch_size=BATCH_SIZE, checkpoint_path=CHECKPOINT_FILE):
+    print("🚀 INITIALIZING PROFESSIONAL REPAIR SYSTEM...")
+    
+    # --- STEP 1: CONNECT TO DB ---
+    try:
+        client = pymongo.MongoClient(MONGO_URL)
+        db = client[DB_NAME]
+        col = db.master_library
+        total_songs = col.estimated_document_count()
+        print(f"✅ DB Connected. Scanning ~{total_songs} songs.")
+    except Exception as e:
+        print(f"❌ DB Connection Failed: {e}")
+        return
+
+    # --- STEP 2: LOAD JSON REFERENCE (The "Source of Truth") ---
+    json_lookup = load_reference()
 
-        stats["processed"] += 1
-        if stats["processed"] % 1000 == 0:
-            print(f"   ...processed {stats['processed']} songs")
+    # --- STEP 3: THE FIX LOOP ---
+    last_id, stats = load_checkpoint(checkpoint_path)
+    if last_id is not None:
+        print(f"\n⏯️ RESUMING after _id {last_id} ({stats['processed']} songs already done)...")
+    else:
+        print("\n🛠️ STARTING BATCH PROCESSING...")
+        stats = {
+            "json_match": 0,
+            "heuristic_fix": 0,
+            "various_hidden": 0,
+            "unchanged": 0,
+            "written": 0,
+            "processed": 0
+        }
+
+    # Walk in _id order so the checkpoint is a single resumable position
+    query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+    cursor = col.find(query, PROJECTION).sort("_id", pymongo.ASCENDING).batch_size(batch_size)
+
+    batch = []
+    for song in cursor:
+        batch.append(song)
+        if len(batch) >= batch_size:
+            flush_batch(col, batch, json_lookup, stats)
+            save_checkpoint(checkpoint_path, batch[-1]["_id"], stats)
+            batch = []
+            print(f"   ...processed {stats['processed']} songs ({stats['written']} updated)")
+
+    if batch:
+        flush_batch(col, batch, json_lookup, stats)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
 
     print("\n✨ REPAIR COMPLETE!")
     print(f"📊 Stats:")
     print(f"   - Matched & Fixed via JSON: {stats['json_match']}")
     print(f"   - Fixed via Heuristics:     {stats['heuristic_fix']}")
     print(f"   - Hidden (Various/Unknown): {stats['various_hidden']}")
+    print(f"   - Documents updated:        {stats['written']}")
+    print(f"   - Already correct:          {stats['unchanged']}")
     print("------------------------------------------------")
     print("👉 YOU MUST RESTART 'main.py' NOW.")
 
 if __name__ == "__main__":
-    run_pro_fix()
\ No newline at end of file
+    run_pro_fix()
@@ -0,0 +1,117 @@
+import os
+import sys
+import asyncio
+import logging
+from datetime import datetime, timezone
+from pymongo.errors import OperationFailure, PyMongoError
+from catalog import SONG_SORT
+
+logger = logging.getLogger("Indexes")
+
+# (collection, keys, options) for every index the backend and scripts rely on
+INDEX_SPECS = [
+    # register/login/state lookups
+    ("users", [("username", 1)], {"name": "username_unique", "unique": True}),
+    # /songs ordering and keyset pagination; the facet filters ride along in FETCH
+    ("master_library", SONG_SORT, {"name": "catalog_sort"}),
+    # Catalog polling and incremental backups
+    ("master_library", [("updated_at", 1)], {"name": "updated_at"}),
+    # /songs 'listen' filter without a genre/title sort prefix to lean on
+    ("master_library", [("duration_seconds", 1), ("_id", 1)], {"name": "duration_seconds"}),
+    # smart_tagger and updater_bot work queues. The queues are read with
+    # {$ne: true}, which a partialFilterExpression cannot express, so these
+    # are plain indexes; $ne still turns into two bounded IXSCAN ranges.
+    ("songs", [("is_enriched", 1), ("_id", 1)], {"name": "enrich_queue"}),
+    ("songs", [("is_verified", 1), ("title", 1)], {"name": "verify_queue"}),
+    # updater_bot marks matches verified by title
+    ("songs", [("title", 1)], {"name": "title"}),
+]
+
+def canonical_queries():
+    """(label, collection, filter, sort, limit) for each hot query path."""
+    epoch = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    visible = {
+        "is_hidden": {"$ne": True},
+        "artist": {"$not": {"$regex": "various|unknown|va -", "$options": "i"}}
+    }
+    return [
+        ("login", "users", {"username": "__self_check__"}, None, 1),
+        ("songs first page", "master_library", visible, SONG_SORT, 101),
+        ("songs genre page", "master_library", {**visible, "genre": {"$regex": "pop", "$options": "i"}}, SONG_SORT, 101),
+        ("catalog poll", "master_library", {"updated_at": {"$gt": epoch}}, None, 0),
+        ("tagger queue", "songs", {"is_enriched": {"$ne": True}}, None, 0),
+        ("verifier queue", "songs", {"is_verified": {"$ne": True}}, None, 0),
+        ("verify by title", "songs", {"title": {"$in": ["__self_check__"]}}, None, 0),
+    ]
+
+async def ensure_indexes(db):
+    """Creates missing indexes; returns the names that could not be built."""
+    failed = []
+    for collection, keys, options in INDEX_SPECS:
+        try:
+            await db[collection].create_index(keys, **options)
+        except OperationFailure as e:
+            # e.g. duplicate usernames blocking the unique index, or a name clash
+            logger.error("⚠️ Could not create %s.%s: %s", collection, options['name'], e)
+            failed.append(f"{collection}.{options['name']}")
+        except PyMongoError as e:
+            logger.error("⚠️ Index provisioning aborted: %s", e)
+            failed.append(f"{collection}.{options['name']}")
+            break
+    return failed
+
+def _stages(plan):
+    """Every plan stage name in an explain() tree, whatever the server version."""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _stages(value)
+
+async def check_query_plans(db):
+    """Explains each canonical query; returns {label: [stages]} for the ones that COLLSCAN."""
+    scans = {}
+    for label, collection, query, sort, limit in canonical_queries():
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        try:
+            explained = await cursor.explain()
+        except PyMongoError as e:
+            logger.error("⚠️ explain() failed for '%s': %s", label, e)
+            continue
+        stages = list(_stages(explained.get("queryPlanner", {}).get("winningPlan", {})))
+        if "COLLSCAN" in stages:
+            scans[label] = stages
+            logger.warning("🐢 Query plan regression: '%s' on %s does a COLLSCAN (%s)", label, collection, ' > '.join(stages))
+        else:
+            logger.debug("✅ Query plan ok: '%s' (%s)", label, ' > '.join(stages))
+    return scans
+
+async def provision(db, self_check=True):
+    failed = await ensure_indexes(db)
+    scans = await check_query_plans(db) if self_check else {}
+    if not failed and not scans:
+        logger.info("🗂️ Indexes ready (%s specs, plans verified)", len(INDEX_SPECS))
+    return {"failed": failed, "collection_scans": scans}
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    client = AsyncIOMotorClient(os.getenv("MONGO_URL"))
+    report = asyncio.run(provision(client[os.getenv("DB_NAME", "music_app_pro")]))
+    for name in report["failed"]:
+        print(f"❌ Missing index: {name}")
+    for label, stages in report["collection_scans"].items():
+        print(f"🐢 COLLSCAN: {label} ({' > '.join(stages)})")
+    if report["failed"] or report["collection_scans"]:
+        sys.exit(1)
+    print("✅ All indexes present and every canonical query uses one.")
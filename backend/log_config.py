@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import uuid
+import atexit
+import queue
+import random
+import logging
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Set per HTTP request by RequestIdMiddleware; "-" outside a request
+request_id = contextvars.ContextVar("request_id", default="-")
+
+# Third-party loggers that flood DEBUG with wire-level chatter
+LIBRARY_LOGGERS = ("motor", "pymongo", "httpx", "httpcore", "telethon", "asyncio", "passlib", "multipart")
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+# LogRecord attributes that are not user-supplied `extra` fields
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; `extra={...}` fields are copied to the top level."""
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class ContextFilter(logging.Filter):
+    """
+    Runs on the caller's side of the queue: stamps the request id (the
+    contextvar is only visible there) and samples DEBUG records.
+    """
+    def __init__(self, debug_sample=1.0):
+        super().__init__()
+        self.debug_sample = debug_sample
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG and self.debug_sample < 1.0 and random.random() >= self.debug_sample:
+            self.dropped += 1
+            return False
+        record.request_id = request_id.get()
+        return True
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that enqueues the record untouched. The stock prepare()
+    renders the message on the calling thread, which is exactly the work we
+    want off the event loop; the listener thread formats instead. Log args
+    must therefore not be mutated after the call (ours are plain values).
+    """
+    def prepare(self, record):
+        return record
+
+class _State:
+    listener = None
+    context = None
+    handler = None   # the DeferredQueueHandler while the listener runs
+    output = None    # the real stdout handler
+
+def setup_logging():
+    """
+    Configures the root logger from the environment:
+      LOG_LEVEL (INFO), LOG_FORMAT (text|json), LOG_LIBRARY_LEVEL (WARNING),
+      LOG_DEBUG_SAMPLE (fraction of DEBUG records kept, 1.0).
+    Records go through an unbounded in-memory queue to a background thread
+    that does the formatting and the stdout write. Idempotent, and safe to
+    call again after shutdown_logging() (e.g. a second lifespan).
+    """
+    if _State.listener is not None:
+        return _State.listener
+
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+    library_level = os.getenv("LOG_LIBRARY_LEVEL", "WARNING").upper()
+    output = logging.StreamHandler(sys.stdout)
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    _State.context = ContextFilter(float(os.getenv("LOG_DEBUG_SAMPLE", "1.0")))
+    handler.addFilter(_State.context)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name in LIBRARY_LOGGERS:
+        logging.getLogger(name).setLevel(library_level)
+
+    _State.handler = handler
+    _State.output = output
+    _State.listener = QueueListener(records, output, respect_handler_level=True)
+    _State.listener.start()
+    return _State.listener
+
+def shutdown_logging():
+    """
+    Drains the queue, stops the writer thread and puts the stdout handler
+    directly on the root logger, so records logged afterwards (uvicorn's
+    shutdown lines, interpreter exit) are still written, synchronously.
+    """
+    if _State.listener is None:
+        return
+    root = logging.getLogger()
+    root.removeHandler(_State.handler)
+    _State.listener.stop()
+    _State.output.addFilter(_State.context)
+    root.addHandler(_State.output)
+    _State.listener = None
+
+# Records still queued when the interpreter exits would otherwise be lost
+atexit.register(shutdown_logging)
+
+def dropped_debug_records():
+    return _State.context.dropped if _State.context else 0
+
+class RequestIdMiddleware:
+    """
+    Pure ASGI middleware: takes X-Request-ID from the client (or makes one),
+    exposes it to every log line of the request and echoes it back.
+    """
+    HEADER = b"x-request-id"
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        rid = None
+        for name, value in scope["headers"]:
+            if name == self.HEADER:
+                rid = value.decode("latin-1")[:64]
+                break
+        rid = rid or uuid.uuid4().hex[:16]
+        token = request_id.set(rid)
+
+        async def tagged_send(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(self.HEADER, rid.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, tagged_send)
+        finally:
+            request_id.reset(token)
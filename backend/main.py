@@ -4,26 +4,44 @@ import re
 import httpx
 import jwt
 import asyncio
+import time
 from datetime import datetime, timedelta
 from typing import Optional, List
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 from passlib.context import CryptContext
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from contextlib import asynccontextmanager
-from bot_manager import BotManager 
+from bot_manager import BotManager, SwarmBusyError, load_bot_tokens
+from streaming import (
+    ChunkSource, LeasedStreamingResponse, RangeNotSatisfiable, iter_file_range, parse_range_header
+)
+from chunk_cache import ChunkCache
+from prefetch import Prefetcher
+from response_cache import ResponseCache, etag_matches
+from password_hasher import HasherBusyError, PasswordHasher
+from auth_cache import TokenCache, UserCache
+from state_sync import StateConflict, StateSyncer
+from classifier import DURATION_FILTERS
+import indexes
+import workers
+from log_config import RequestIdMiddleware, setup_logging, shutdown_logging
+from metrics import MetricsMiddleware, MongoCommandListener, monitor_loop_lag, registry
+from catalog import (
+    FALLBACK_CURSOR, SONG_SORT, Catalog, SongRecord, cursor_sort_key, decode_cursor, encode_cursor,
+    keyset_filter, sort_key_for
+)
 from dotenv import load_dotenv
 
-# 1. Setup & Configuration with Verbose Debugging
-logging.basicConfig(
-    level=logging.DEBUG, 
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
-logger = logging.getLogger(__name__)
+# 1. Setup & Configuration (LOG_LEVEL / LOG_FORMAT / LOG_DEBUG_SAMPLE, see log_config)
 load_dotenv()
+setup_logging()
+logger = logging.getLogger(__name__)
 
 # --- AUTH CONFIGURATION ---
 SECRET_KEY = os.getenv("JWT_SECRET")
@@ -35,18 +53,60 @@ if not SECRET_KEY:
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_DAYS = 30
 
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# PBKDF2_ROUNDS pins the cost; hashes made with any other cost are upgraded on login
+PBKDF2_ROUNDS = os.getenv("PBKDF2_ROUNDS")
+rounds_policy = {}
+if PBKDF2_ROUNDS:
+    rounds_policy = {
+        "pbkdf2_sha256__default_rounds": int(PBKDF2_ROUNDS),
+        "pbkdf2_sha256__min_rounds": int(PBKDF2_ROUNDS),
+        "pbkdf2_sha256__max_rounds": int(PBKDF2_ROUNDS),
+    }
+pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto", **rounds_policy)
+password_hasher = PasswordHasher(
+    pwd_context,
+    workers=int(os.getenv("HASH_WORKERS", "2")),
+    max_queue=int(os.getenv("HASH_QUEUE_LIMIT", "32"))
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
+token_cache = TokenCache(max_entries=int(os.getenv("TOKEN_CACHE_SIZE", "10000")))
+# WEB_CONCURRENCY > 1 runs that many processes; each owns a share of the bots
+WORKERS = workers.worker_count()
+worker_slot = None
+user_cache = UserCache(
+    max_entries=int(os.getenv("USER_CACHE_SIZE", "5000")),
+    # Sibling processes write db.users too, so cached state must expire quickly
+    ttl=int(os.getenv("USER_CACHE_TTL", "300" if WORKERS == 1 else "5"))
+)
 
 # Initialize Global Managers
 manager = BotManager()
+chunk_cache = ChunkCache(
+    os.getenv("AUDIO_CACHE_DIR", "cache/audio"),
+    int(os.getenv("AUDIO_CACHE_MAX_MB", "2048")) * 1024 * 1024,
+    shared=WORKERS > 1
+)
+PARALLEL_PARTS = int(os.getenv("STREAM_PARALLEL_PARTS", "4"))
+prefetcher = Prefetcher(manager, chunk_cache, seconds=int(os.getenv("PREFETCH_SECONDS", "15")))
 MONGO_URL = os.getenv("MONGO_URL")
 if not MONGO_URL:
     logger.error("❌ MONGO_URL missing from environment")
 
-mongo_client = AsyncIOMotorClient(MONGO_URL)
+mongo_client = AsyncIOMotorClient(MONGO_URL, event_listeners=[MongoCommandListener()])
 DB_NAME = os.getenv("DB_NAME", "music_app_pro")
 db = mongo_client[DB_NAME]
+catalog = Catalog(
+    db.master_library,
+    poll_interval=int(os.getenv("CATALOG_POLL_SECONDS", "30")),
+    full_reload_interval=int(os.getenv("CATALOG_FULL_RELOAD_SECONDS", "600"))
+)
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "512")),
+    ttl=int(os.getenv("RESPONSE_CACHE_TTL", "60"))
+)
+INDEX_SELF_CHECK = os.getenv("INDEX_SELF_CHECK", "1") != "0"
+index_report = {}
+CATALOG_CACHE_CONTROL = f"public, max-age={os.getenv('CATALOG_MAX_AGE', '30')}, stale-while-revalidate=60"
 
 # --- SCHEMAS ---
 class UserAuth(BaseModel):
@@ -59,26 +119,69 @@ class UserStateSync(BaseModel):
     volume: float = 0.7
     selected_language: str = "all"
 
+class StatePatch(BaseModel):
+    base_version: Optional[int] = None
+    client_id: Optional[str] = None
+    liked_add: List[dict] = []
+    liked_remove: List[str] = []
+    updates: dict = {}
+
+# Fields a patch may set directly; liked_songs only changes through liked_add/liked_remove
+PATCHABLE_FIELDS = set(UserStateSync.__fields__) - {"liked_songs"}
+
+class PrefetchRequest(BaseModel):
+    msg_ids: List[int]
+    seconds: Optional[int] = None
+
+async def provision_indexes():
+    """Creates the indexes every query path relies on, then verifies their plans."""
+    index_report.update(await indexes.provision(db, self_check=INDEX_SELF_CHECK))
+
 # --- 🚀 100% LOGICAL LIFECYCLE (BACKGROUND INIT) ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global worker_slot
+    # No-op on first start; re-installs the queued handler after a previous lifespan
+    setup_logging()
     logger.info("🤖 System Init: Starting FastAPI...")
+    # Claimed here, not at import: `python main.py` imports this module in the
+    # supervisor too, and that process must not hold a slot
+    worker_slot = await asyncio.to_thread(workers.claim_slot, WORKERS)
+    manager.assign_partition(worker_slot.index, WORKERS)
+    janitor_task = None
+    if chunk_cache.shared and worker_slot.is_primary:
+        chunk_cache.owns_disk = True
+        janitor_task = asyncio.create_task(chunk_cache.run_janitor())
     
     # 🟢 LOGICAL FIX: Start Telegram Bots in background to avoid Render Port-Binding Timeout
     logger.debug("📡 Scheduling Bot Swarm initialization in background...")
-    bot_task = asyncio.create_task(manager.start())
+    bot_task = asyncio.create_task(manager.run())
+    prefetch_task = asyncio.create_task(prefetcher.run())
+    catalog_task = asyncio.create_task(catalog.run())
+    index_task = asyncio.create_task(provision_indexes())
+    lag_task = asyncio.create_task(monitor_loop_lag())
     
     yield
     
     logger.info("🛑 System Shutdown: Cleaning up background tasks and connections...")
     bot_task.cancel()
+    prefetch_task.cancel()
+    catalog_task.cancel()
+    index_task.cancel()
+    lag_task.cancel()
+    if janitor_task:
+        janitor_task.cancel()
+    password_hasher.shutdown()
+    await state_syncer.flush_all()
     try:
         for worker in manager.workers:
             if worker.client and worker.client.is_connected():
                 await worker.client.disconnect()
         logger.debug("✅ All bots disconnected successfully.")
     except Exception as e:
-        logger.error(f"⚠️ Error during shutdown cleanup: {e}")
+        logger.error("⚠️ Error during shutdown cleanup: %s", e)
+    worker_slot.release()
+    shutdown_logging()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -93,10 +196,47 @@ app.add_middleware(
         "*" # Wildcard for safety during deployment testing
     ],
     allow_credentials=True, 
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"], 
-    allow_headers=["Authorization", "Content-Type", "Accept", "X-Requested-With"],
+    allow_methods=["GET", "HEAD", "POST", "PUT", "DELETE", "OPTIONS"], 
+    allow_headers=["Authorization", "Content-Type", "Accept", "X-Requested-With", "Range", "X-Request-ID"],
     expose_headers=["*"],
 )
+# Added last so it wraps everything, CORS preflights included
+app.add_middleware(MetricsMiddleware)
+# Outermost: every log line of a request carries its X-Request-ID
+app.add_middleware(RequestIdMiddleware)
+
+# --- 📈 METRICS (read from live objects at scrape time) ---
+def bot_samples(read):
+    return lambda: [((str(w.index + 1),), read(w)) for w in manager.workers]
+
+def cache_samples(field):
+    caches = {
+        "audio": chunk_cache, "media": manager.media_cache, "responses": response_cache,
+        "tokens": token_cache, "users": user_cache
+    }
+    return lambda: [((name,), cache.stats()[field]) for name, cache in caches.items()]
+
+registry.sampled("bot_connected", "1 while the bot is connected and logged in", "gauge", ("bot",),
+                 bot_samples(lambda w: int(w.is_connected())))
+registry.sampled("bot_reconnects_total", "Background reconnects per bot", "counter", ("bot",),
+                 bot_samples(lambda w: w.reconnects))
+registry.sampled("bot_active_streams", "Open /stream responses per bot", "gauge", ("bot",),
+                 bot_samples(lambda w: w.active_streams))
+registry.sampled("bot_in_flight_requests", "Outstanding upload.getFile requests per bot", "gauge", ("bot",),
+                 bot_samples(lambda w: w.in_flight))
+registry.sampled("bot_bytes_sent_total", "Bytes downloaded from Telegram per bot", "counter", ("bot",),
+                 bot_samples(lambda w: w.bytes_sent))
+registry.sampled("bot_bytes_per_second", "Smoothed download rate per bot", "gauge", ("bot",),
+                 bot_samples(lambda w: round(w.bytes_per_sec, 1)))
+registry.sampled("bot_flood_waits_total", "FloodWait errors per bot", "counter", ("bot",),
+                 bot_samples(lambda w: w.flood_waits))
+registry.sampled("bot_errors_total", "Download errors per bot", "counter", ("bot",),
+                 bot_samples(lambda w: w.errors))
+registry.sampled("bot_cooldown_seconds", "Remaining FloodWait cooldown per bot", "gauge", ("bot",),
+                 bot_samples(lambda w: round(max(0.0, w.cooldown_until - time.time()), 1)))
+registry.sampled("cache_hits_total", "Cache hits", "counter", ("cache",), cache_samples("hits"))
+registry.sampled("cache_misses_total", "Cache misses", "counter", ("cache",), cache_samples("misses"))
+registry.sampled("cache_hit_ratio", "Cache hit ratio since start", "gauge", ("cache",), cache_samples("hit_ratio"))
 
 # --- AUTH HELPERS ---
 def create_access_token(data: dict):
@@ -106,6 +246,10 @@ def create_access_token(data: dict):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
+    username = token_cache.get(token)
+    if username:
+        return username
+
     logger.debug("🔐 Verifying JWT Access Token...")
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -113,138 +257,368 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         if username is None:
             logger.warning("🚫 Token validation failed: Missing sub")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+        token_cache.put(token, username, payload["exp"])
         return username
     except jwt.PyJWTError as e:
-        logger.error(f"🚫 JWT Decode Error: {e}")
+        logger.error("🚫 JWT Decode Error: %s", e)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
-def clean_title(title):
-    if not title: return "Unknown Title"
-    title = re.sub(r'\.(mp3|m4a|flac|wav)$', '', title, flags=re.IGNORECASE)
-    patterns = [
-        r'\(.*?official.*?video.*?\)', r'\[.*?official.*?video.*?\]',
-        r'\(.*?lyric.*?video.*?\)', r'\[.*?video.*?\]',
-        r'\(.*?audio.*?\)', r'\[.*?4k.*?\]', r'\|.*', r'\d+kbps',
-        r'\(.*?\d{4}.*?\)'
-    ]
-    for p in patterns:
-        title = re.sub(p, '', title, flags=re.IGNORECASE)
-    return title.strip()
+async def load_user(username):
+    """Recently active users come from the write-through cache, others from MongoDB."""
+    db_user = user_cache.get(username)
+    if db_user is None:
+        db_user = await db.users.find_one({"username": username}, {field: 1 for field in UserCache.FIELDS})
+        if db_user:
+            db_user = user_cache.put(db_user)
+    return db_user
+
+state_syncer = StateSyncer(
+    db.users, user_cache, load_user,
+    debounce=float(os.getenv("STATE_SYNC_DEBOUNCE", "2")),
+    # Sibling processes patch the same users: version every write in MongoDB
+    shared=WORKERS > 1
+)
+
+def catalog_response(request: Request, key, build):
+    """
+    Serves a catalog query from the shared result cache (rendering it with
+    `build` on a miss) with a strong ETag, answering If-None-Match with 304.
+    """
+    entry = response_cache.get(key, catalog.version)
+    if entry is None:
+        entry = response_cache.put(key, catalog.version, build())
+    headers = {"ETag": entry.etag, "Cache-Control": CATALOG_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
 
 # --- ROUTES ---
 
 @app.post("/auth/register")
 async def register(user: UserAuth):
-    logger.info(f"📝 Registration request for: {user.username}")
-    existing = await db.users.find_one({"username": user.username})
+    logger.info("📝 Registration request for: %s", user.username)
+    existing = await load_user(user.username)
     if existing:
-        logger.warning(f"⚠️ Registration failed: {user.username} already exists")
+        logger.warning("⚠️ Registration failed: %s already exists", user.username)
         raise HTTPException(status_code=400, detail="Username already exists")
     
-    hashed_password = pwd_context.hash(user.password)
+    try:
+        hashed_password = await password_hasher.hash(user.password)
+    except HasherBusyError:
+        logger.warning("⏳ Hash queue full, rejecting registration for: %s", user.username)
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
     new_user = {
         "username": user.username,
         "password": hashed_password,
         "state": UserStateSync().dict(),
         "created_at": datetime.utcnow()
     }
-    await db.users.insert_one(new_user)
-    logger.info(f"✅ User {user.username} registered successfully")
+    try:
+        await db.users.insert_one(new_user)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration (username_unique index)
+        raise HTTPException(status_code=400, detail="Username already exists")
+    user_cache.put(new_user)
+    logger.info("✅ User %s registered successfully", user.username)
     return {"msg": "Registration successful"}
 
 @app.post("/auth/login")
 async def login(user: UserAuth):
-    logger.info(f"🔑 Login attempt for: {user.username}")
-    db_user = await db.users.find_one({"username": user.username})
-    if not db_user or not pwd_context.verify(user.password, db_user["password"]):
-        logger.warning(f"🚫 Invalid login for: {user.username}")
+    logger.info("🔑 Login attempt for: %s", user.username)
+    db_user = await load_user(user.username)
+    if not db_user:
+        logger.warning("🚫 Invalid login for: %s", user.username)
         raise HTTPException(status_code=401, detail="Invalid username or password")
+    try:
+        valid, new_hash = await password_hasher.verify_and_update(user.password, db_user["password"])
+    except HasherBusyError:
+        logger.warning("⏳ Hash queue full, rejecting login for: %s", user.username)
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+    if not valid:
+        logger.warning("🚫 Invalid login for: %s", user.username)
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    if new_hash:
+        # Configured cost changed since this hash was made: store the upgrade
+        await db.users.update_one({"_id": db_user["_id"]}, {"$set": {"password": new_hash}})
+        user_cache.update(user.username, password=new_hash)
+        logger.info("🔁 Rehashed password for %s", user.username)
     
     access_token = create_access_token(data={"sub": user.username})
-    logger.info(f"✅ User {user.username} logged in")
+    logger.info("✅ User %s logged in", user.username)
     return {
         "access_token": access_token, 
         "token_type": "bearer",
         "username": user.username,
-        "state": db_user.get("state")
+        "state": db_user.get("state"),
+        "state_version": db_user.get("state_version") or 0
     }
 
 @app.post("/user/sync")
 async def sync_state(state: UserStateSync, username: str = Depends(get_current_user)):
-    logger.debug(f"🔄 Syncing state for user: {username}")
+    logger.debug("🔄 Syncing state for user: %s", username)
     try:
-        await db.users.update_one(
+        new_state = state.dict()
+        # A full snapshot supersedes batched patches; they are written (in order) first
+        await state_syncer.replace(username)
+        # $inc keeps versions unique even when another process patched meanwhile
+        updated = await db.users.find_one_and_update(
             {"username": username},
-            {"$set": {"state": state.dict()}}
+            {"$set": {"state": new_state}, "$inc": {"state_version": 1}, "$unset": {"state_marks": ""}},
+            projection={"state_version": 1},
+            return_document=ReturnDocument.AFTER
         )
-        return {"msg": "Sync successful"}
+        version = updated["state_version"] if updated else 0
+        user_cache.update(username, state=new_state, state_version=version, state_marks={})
+        return {"msg": "Sync successful", "version": version}
     except Exception as e:
-        logger.error(f"❌ Sync Error for {username}: {e}")
+        logger.error("❌ Sync Error for %s: %s", username, e)
         raise HTTPException(status_code=500, detail="Failed to sync user data")
 
+@app.get("/user/state")
+async def get_state(username: str = Depends(get_current_user)):
+    db_user = await load_user(username)
+    if not db_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"username": username, "state": db_user.get("state"), "state_version": db_user.get("state_version") or 0}
+
+@app.post("/user/sync/patch")
+async def patch_state(patch: StatePatch, username: str = Depends(get_current_user)):
+    """
+    Applies a small state delta (like/unlike, volume, language, current song).
+    Writes are coalesced server side, so clients can send one per change.
+    """
+    unknown = set(patch.updates) - PATCHABLE_FIELDS
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown state fields: {', '.join(sorted(unknown))}")
+    try:
+        version = await state_syncer.apply(
+            username, patch.base_version, patch.client_id,
+            liked_add=patch.liked_add, liked_remove=patch.liked_remove, updates=patch.updates
+        )
+    except KeyError:
+        raise HTTPException(status_code=404, detail="User not found")
+    except StateConflict as e:
+        logger.info("⚔️ State conflict for %s at version %s", username, e.version)
+        return JSONResponse(
+            status_code=409,
+            content={"detail": "State changed on another device", "version": e.version, "state": e.state}
+        )
+    return {"version": version}
+
 @app.get("/songs")
 async def get_songs(
-    search: str = None, genre: str = 'all', mood: str = 'all', 
-    listen: str = 'all', language: str = 'all', limit: int = 100, skip: int = 0
+    request: Request, search: str = None, genre: str = 'all', mood: str = 'all', 
+    listen: str = 'all', language: str = 'all', limit: int = 100, skip: int = 0,
+    cursor: str = None
 ):
-    logger.debug(f"🎵 Fetching songs. Filter: Genre={genre}, Language={language}, Search={search}")
+    logger.debug("🎵 Fetching songs. Filter: Genre=%s, Language=%s, Search=%s", genre, language, search)
+    try:
+        page_cursor = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if catalog.ready:
+        def build():
+            results, next_cursor = catalog.index.query(
+                search, genre, mood, listen, language, limit, skip, page_cursor
+            )
+            return {"results": results, "next_cursor": next_cursor}
+
+        key = (
+            "songs", " ".join((search or "").lower().split()), (genre or "all").lower(),
+            (mood or "all").lower(), listen, (language or "all").lower(), limit, skip, cursor
+        )
+        try:
+            return catalog_response(request, key, build)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # Catalog still warming up: fall back to querying MongoDB directly
     query = {
         "is_hidden": {"$ne": True}, 
         "artist": {"$not": {"$regex": "various|unknown|va -", "$options": "i"}}
     }
     
     if search:
-        search_terms = search.split()
+        search_terms = [re.escape(term) for term in search.split()]
         and_conditions = [{"$or": [{"title": {"$regex": term, "$options": "i"}}, {"artist": {"$regex": term, "$options": "i"}}]} for term in search_terms]
         query["$and"] = and_conditions
     
-    if genre and genre.lower() != 'all': query["genre"] = {"$regex": genre, "$options": "i"}
-    if mood and mood.lower() != 'all': query["mood"] = {"$regex": mood, "$options": "i"}
-    if language and language.lower() != 'all': query["language"] = {"$regex": language, "$options": "i"}
+    if genre and genre.lower() != 'all': query["genre"] = {"$regex": re.escape(genre), "$options": "i"}
+    if mood and mood.lower() != 'all': query["mood"] = {"$regex": re.escape(mood), "$options": "i"}
+    if language and language.lower() != 'all': query["language"] = {"$regex": re.escape(language), "$options": "i"}
     
-    if listen and listen.lower() != 'all':
-        if listen == "Short": query["duration_seconds"] = {"$lt": 180}
-        elif listen == "Mid": query["duration_seconds"] = {"$gte": 180, "$lte": 300}
-        elif listen == "Long": query["duration_seconds"] = {"$gt": 300}
+    if listen in DURATION_FILTERS: query["duration_seconds"] = dict(DURATION_FILTERS[listen])
+
+    searching = bool(search and search.strip())
+    if page_cursor and (page_cursor.get("src") == FALLBACK_CURSOR) != searching:
+        # Only this path's own search offsets apply here; a catalog search
+        # cursor is a BM25 rank, and browsing pages by keyset
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if page_cursor and "k" in page_cursor:
+        try:
+            query.setdefault("$and", []).append(keyset_filter(cursor_sort_key(page_cursor)))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        skip = 0
+    elif page_cursor:
+        skip = page_cursor["o"]
 
     try:
-        cursor = db.master_library.find(query).skip(skip).limit(limit).sort([("genre", 1), ("title", 1)])
-        songs = await cursor.to_list(length=limit)
-        results = [{
-            "id": str(song["_id"]),
-            "title": clean_title(song.get("title")),
-            "artist": song.get("artist") or "Unknown Artist", 
-            "album_art": song.get("album_art") or "https://placehold.co/300",
-            "msg_id": song["_id"],
-            "duration": song.get("duration", "0:00"), 
-            "duration_seconds": song.get("duration_seconds", 0), 
-            "genre": str(song.get("genre", "Unknown")),
-            "mood": str(song.get("mood", "Unknown")),
-            "language": str(song.get("language", "Unknown")),
-            "is_playable": True
-        } for song in songs]
-        return {"results": results}
+        # One extra row tells us whether another page exists
+        db_cursor = db.master_library.find(query).skip(skip).limit(limit + 1).sort(SONG_SORT)
+        songs = await db_cursor.to_list(length=limit + 1)
+        next_cursor = None
+        if len(songs) > limit and limit > 0:
+            # Search offsets are tagged so the catalog refuses them once it is ready
+            next_cursor = encode_cursor(
+                {"o": skip + limit, "src": FALLBACK_CURSOR} if searching
+                else {"k": sort_key_for(songs[limit - 1])}
+            )
+        results = [SongRecord(song).payload for song in songs[:limit]]
+        return {"results": results, "next_cursor": next_cursor}
     except Exception as e:
-        logger.error(f"❌ DB Fetch Error: {e}")
+        logger.error("❌ DB Fetch Error: %s", e)
         raise HTTPException(status_code=500, detail="Database error")
 
-@app.get("/stream/{msg_id}")
-async def stream_song(msg_id: int):
-    logger.info(f"🔊 Stream request for ID: {msg_id}")
-    worker, message = await manager.get_audio_stream(msg_id)
-    if not worker or not message:
-        logger.warning(f"❌ Audio file not found for ID: {msg_id}")
+@app.get("/songs/suggest")
+async def suggest_songs(request: Request, q: str, limit: int = 8):
+    """Typeahead: top matches for a partial query plus word completions."""
+    if not catalog.ready:
+        return {"results": [], "completions": []}
+    limit = min(limit, 20)
+    key = ("suggest", " ".join(q.lower().split()), limit)
+    return catalog_response(request, key, lambda: catalog.index.suggest(q, limit))
+
+@app.get("/songs/facets")
+async def song_facets(
+    request: Request, search: str = None, genre: str = 'all', mood: str = 'all',
+    listen: str = 'all', language: str = 'all'
+):
+    """Counts per genre/mood/language/duration value for the current filter context."""
+    if not catalog.ready:
+        return {"total": 0, "genre": [], "mood": [], "language": [], "listen": []}
+    key = (
+        "facets", " ".join((search or "").lower().split()), (genre or "all").lower(),
+        (mood or "all").lower(), listen, (language or "all").lower()
+    )
+    return catalog_response(
+        request, key, lambda: catalog.index.facets(search, genre, mood, listen, language)
+    )
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "audio": chunk_cache.stats(),
+        "media": manager.media_cache.stats(),
+        "prefetch": prefetcher.stats(),
+        "responses": response_cache.stats(),
+        "tokens": token_cache.stats(),
+        "users": user_cache.stats(),
+        "state_sync": state_syncer.stats()
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of request, swarm, MongoDB, cache and loop metrics."""
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/ready")
+async def readiness():
+    """Swarm state for load balancers: 200 once a bot can serve streams, 503 before."""
+    swarm = manager.status()
+    body = {
+        "ready": swarm["ready"] > 0, "catalog": catalog.ready, "swarm": swarm,
+        "worker": {"slot": worker_slot.index + 1, "of": WORKERS, "pid": os.getpid()} if worker_slot else None
+    }
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+@app.get("/stats/hashing")
+async def hashing_stats():
+    return password_hasher.stats()
+
+@app.get("/stats/indexes")
+async def index_stats():
+    """Outcome of startup index provisioning and the explain() self-check."""
+    return index_report or {"status": "pending"}
+
+@app.post("/stream/prefetch")
+async def prefetch_songs(req: PrefetchRequest):
+    """Warms metadata and the opening seconds of upcoming tracks at low priority."""
+    if len(req.msg_ids) > 50:
+        raise HTTPException(status_code=400, detail="Too many ids (max 50)")
+    seconds = min(req.seconds, 60) if req.seconds else None
+    queued = prefetcher.enqueue(req.msg_ids, seconds)
+    logger.debug("🔥 Prefetch queued %s/%s songs", queued, len(req.msg_ids))
+    return {"queued": queued}
+
+@app.api_route("/stream/{msg_id}", methods=["GET", "HEAD"])
+async def stream_song(msg_id: int, request: Request):
+    logger.info("🔊 Stream request for ID: %s", msg_id)
+    try:
+        worker, descriptor = await manager.get_audio_stream(msg_id)
+    except SwarmBusyError:
+        logger.warning("⏳ Swarm saturated, rejecting stream for ID: %s", msg_id)
+        raise HTTPException(status_code=503, detail="All bots are busy, retry shortly", headers={"Retry-After": "2"})
+    if not worker or not descriptor:
+        logger.warning("❌ Audio file not found for ID: %s", msg_id)
         raise HTTPException(status_code=404, detail="File not found")
-    
-    async def iterfile():
-        async for chunk in worker.client.iter_download(message.media):
-            yield chunk
-    
-    return StreamingResponse(iterfile(), media_type=message.file.mime_type or "audio/mpeg")
+
+    size = descriptor.size or 0
+    media_type = descriptor.mime_type or "audio/mpeg"
+    headers = {"Accept-Ranges": "bytes"}
+
+    try:
+        byte_range = parse_range_header(request.headers.get("range"), size)
+    except RangeNotSatisfiable:
+        logger.warning("⚠️ Unsatisfiable range for ID %s: %s", msg_id, request.headers.get('range'))
+        manager.release_stream(worker)
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if byte_range:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    else:
+        start, end = 0, size - 1
+        status_code = 200
+    headers["Content-Length"] = str(end - start + 1)
+
+    if request.method == "HEAD":
+        manager.release_stream(worker)
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+
+    logger.debug("📦 Serving bytes %s-%s/%s for ID: %s", start, end, size, msg_id)
+    sources = [
+        ChunkSource(w, d, refresh=lambda w=w: manager.refresh_media(w, msg_id))
+        for w, d in manager.get_stream_sources(msg_id, worker, descriptor, max_helpers=PARALLEL_PARTS - 1)
+    ]
+    chunks = iter_file_range(
+        sources, start, end,
+        cache=chunk_cache, cache_key=(manager.channel_id, msg_id),
+        window=PARALLEL_PARTS
+    )
+    return LeasedStreamingResponse(
+        chunks,
+        on_close=manager.stream_lease(worker),
+        status_code=status_code,
+        headers=headers,
+        media_type=media_type
+    )
 
 if __name__ == "__main__":
     import uvicorn
     # Render uses 'PORT' environment variable
     port = int(os.getenv("PORT", 8000))
-    logger.info(f"🚀 Starting Uvicorn on port {port}")
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    logger.info("🚀 Starting Uvicorn on port %s with %s worker(s)", port, WORKERS)
+    # log_config=None: uvicorn's loggers propagate into the queued root handler
+    if WORKERS > 1:
+        # Fail before forking rather than in every worker's lifespan
+        if WORKERS > len(load_bot_tokens()):
+            logger.critical("❌ WEB_CONCURRENCY=%s but only %s bot token(s) configured", WORKERS, len(load_bot_tokens()))
+            shutdown_logging()
+            raise SystemExit(1)
+        # Workers re-import main by name; each claims a slot in its lifespan
+        uvicorn.run("main:app", host="0.0.0.0", port=port, workers=WORKERS, log_config=None)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port, log_config=None)
\ No newline at end of file
@@ -0,0 +1,104 @@
+import time
+from collections import OrderedDict
+from telethon import types
+
+class MediaDescriptor:
+    """Everything needed to download a channel file without re-reading the message."""
+    __slots__ = ("msg_id", "dc_id", "document_id", "access_hash", "file_reference",
+                 "size", "mime_type", "duration", "fetched_at")
+
+    def __init__(self, msg_id, dc_id, document_id, access_hash, file_reference, size, mime_type, duration=0):
+        self.msg_id = msg_id
+        self.dc_id = dc_id
+        self.document_id = document_id
+        self.access_hash = access_hash
+        self.file_reference = file_reference
+        self.size = size
+        self.mime_type = mime_type
+        self.duration = duration
+        self.fetched_at = time.monotonic()
+
+    @classmethod
+    def from_message(cls, message):
+        """Builds a descriptor from a Telethon message, or None if it carries no document."""
+        document = getattr(message, "document", None) if message else None
+        if not document:
+            return None
+        duration = next(
+            (a.duration for a in document.attributes if isinstance(a, types.DocumentAttributeAudio)), 0
+        )
+        return cls(
+            msg_id=message.id,
+            dc_id=document.dc_id,
+            document_id=document.id,
+            access_hash=document.access_hash,
+            file_reference=document.file_reference,
+            size=document.size,
+            mime_type=document.mime_type,
+            duration=duration or 0
+        )
+
+    def location(self):
+        return types.InputDocumentFileLocation(
+            id=self.document_id,
+            access_hash=self.access_hash,
+            file_reference=self.file_reference,
+            thumb_size=""
+        )
+
+class MediaCache:
+    """
+    Bounded TTL cache of resolved media descriptors.
+    Entries are keyed by (bot index, msg_id) because access hashes and file
+    references are handed out per bot session.
+    """
+    def __init__(self, max_entries=5000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def peek(self, bot_index, msg_id):
+        """Returns a fresh descriptor without touching LRU order or hit counters."""
+        descriptor = self._entries.get((bot_index, msg_id))
+        if descriptor is None or time.monotonic() - descriptor.fetched_at > self.ttl:
+            return None
+        return descriptor
+
+    def lookup(self, msg_id, bot_indexes):
+        """Returns (bot_index, descriptor) for the first bot holding a fresh entry."""
+        now = time.monotonic()
+        for bot_index in bot_indexes:
+            descriptor = self._entries.get((bot_index, msg_id))
+            if descriptor is not None and now - descriptor.fetched_at <= self.ttl:
+                self._entries.move_to_end((bot_index, msg_id))
+                self.hits += 1
+                return bot_index, descriptor
+        self.misses += 1
+        return None
+
+    def put(self, bot_index, descriptor):
+        key = (bot_index, descriptor.msg_id)
+        self._entries[key] = descriptor
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, bot_index, msg_id):
+        self._entries.pop((bot_index, msg_id), None)
+
+    def missing(self, bot_index, msg_ids):
+        """Returns the ids that have no fresh entry for this bot."""
+        return [msg_id for msg_id in msg_ids if self.peek(bot_index, msg_id) is None]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,181 @@
+import time
+import asyncio
+import threading
+from bisect import bisect_left
+from pymongo import monitoring
+
+# Seconds; spans a cached /songs hit up to a slow Telegram first byte
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=""):
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    """
+    Preaggregated histogram: one fixed bucket array per label combination,
+    so an observation is a bisect plus two additions (no allocation once
+    the label set has been seen).
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()  # pymongo listeners observe from worker threads
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0])
+        with self._lock:
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = []
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total!r}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class Sampled:
+    """Counter or gauge whose values are read from live objects at scrape time."""
+    def __init__(self, name, help, kind, labelnames, collect):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.collect = collect  # () -> iterable of (label values tuple, value)
+
+    def render(self):
+        return [
+            f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+            for labels, value in self.collect()
+        ]
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def sampled(self, name, help, kind, labelnames, collect):
+        metric = Sampled(name, help, kind, labelnames, collect)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+http_latency = registry.histogram(
+    "http_request_duration_seconds", "Time until the response body finished, per route",
+    ("method", "route", "status")
+)
+http_first_byte = registry.histogram(
+    "http_response_first_byte_seconds", "Time until the first body byte (TTFB), per route",
+    ("method", "route")
+)
+mongo_latency = registry.histogram(
+    "mongodb_operation_duration_seconds", "MongoDB command latency per collection and command",
+    ("collection", "command", "outcome")
+)
+loop_lag = registry.histogram(
+    "event_loop_lag_seconds", "How late a periodic timer fires on the event loop", (), LAG_BUCKETS
+)
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware timing every HTTP request. Routes are labelled by
+    their template ('/stream/{msg_id}'), so cardinality stays bounded.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = [500]
+        first_byte = [None]
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            elif message["type"] == "http.response.body" and first_byte[0] is None and message.get("body"):
+                first_byte[0] = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            if first_byte[0] is not None:
+                http_first_byte.observe(first_byte[0] - started, method, path)
+            http_latency.observe(time.perf_counter() - started, method, path, str(status[0]))
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Feeds pymongo command monitoring events into mongo_latency."""
+    IGNORED = {"hello", "isMaster", "ismaster", "ping", "saslStart", "saslContinue", "endSessions", "buildInfo"}
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        if event.command_name in self.IGNORED:
+            return
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else event.command.get("collection", "-")
+        if event.command_name == "getMore":
+            collection = event.command.get("collection", "-")
+        self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event, outcome):
+        collection = self._collections.pop((event.connection_id, event.request_id), None)
+        if collection is not None:
+            mongo_latency.observe(event.duration_micros / 1e6, collection, event.command_name, outcome)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+async def monitor_loop_lag(interval=0.5):
+    """Background task: records how late each timer tick runs."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        loop_lag.observe(max(0.0, loop.time() - expected))
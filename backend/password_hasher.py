@@ -0,0 +1,73 @@
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("PasswordHasher")
+
+class HasherBusyError(Exception):
+    """Raised when the hashing queue is full; callers should answer 503."""
+
+class PasswordHasher:
+    """
+    Runs passlib hashing on a small dedicated thread pool.
+    pbkdf2_sha256 spends its time inside hashlib, which releases the GIL, so
+    threads hash in parallel while the event loop keeps serving streams.
+    At most `workers + max_queue` operations are admitted at once; the rest
+    are rejected immediately instead of piling up behind a login burst.
+    """
+    def __init__(self, context, workers=2, max_queue=32):
+        self.context = context
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pwd-hash")
+        self._admitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    async def _run(self, fn, *args):
+        if self._admitted >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HasherBusyError("Password hashing queue is full")
+        self._admitted += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._admitted -= 1
+            elapsed = time.perf_counter() - started
+            self.completed += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+
+    async def hash(self, password):
+        return await self._run(self.context.hash, password)
+
+    async def verify_and_update(self, password, hashed):
+        """
+        Returns (valid, new_hash). new_hash is set when the stored hash was made
+        with a different cost than the one configured now and should be saved.
+        """
+        valid, new_hash = await self._run(self.context.verify_and_update, password, hashed)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "in_progress": min(self._admitted, self.workers),
+            "queue_depth": max(self._admitted - self.workers, 0),
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "avg_ms": round(self.total_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 2)
+        }
@@ -0,0 +1,108 @@
+import math
+import asyncio
+import logging
+from streaming import CHUNK_SIZE, ChunkSource
+
+logger = logging.getLogger("Prefetch")
+
+# Assumed bitrate when Telegram did not report a duration (320 kbps)
+FALLBACK_BYTES_PER_SEC = 40 * 1024
+
+class Prefetcher:
+    """
+    Low-priority warmer for the next tracks in a listener's queue.
+    Ids are resolved with one batched get_messages call, then the opening
+    seconds of each file are pulled into the ChunkCache one chunk at a time.
+    Work only proceeds while the swarm has spare stream slots, so foreground
+    /stream requests are never queued behind a prefetch.
+    """
+    def __init__(self, manager, cache, seconds=15, max_queue=200, batch_size=20, idle_delay=0.5):
+        self.manager = manager
+        self.cache = cache
+        self.seconds = seconds
+        self.batch_size = batch_size
+        self.idle_delay = idle_delay
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._queued = set()
+        self.warmed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.deferred = 0
+
+    def enqueue(self, msg_ids, seconds=None):
+        """Queues ids for warming; returns how many were newly accepted."""
+        accepted = 0
+        for msg_id in msg_ids:
+            msg_id = int(msg_id)
+            if msg_id in self._queued:
+                continue
+            try:
+                self._queue.put_nowait((msg_id, seconds or self.seconds))
+            except asyncio.QueueFull:
+                self.dropped += 1
+                continue
+            self._queued.add(msg_id)
+            accepted += 1
+        return accepted
+
+    async def _wait_for_capacity(self):
+        while not self.manager.has_spare_capacity():
+            self.deferred += 1
+            await asyncio.sleep(self.idle_delay)
+
+    async def run(self):
+        """Background loop; cancel the task to stop it."""
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                await self._wait_for_capacity()
+                await self.manager.resolve_many([msg_id for msg_id, _ in batch])
+                for msg_id, seconds in batch:
+                    await self._wait_for_capacity()
+                    await self._warm(msg_id, seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.warning("⚠️ Prefetch batch failed: %s", e)
+            finally:
+                for msg_id, _ in batch:
+                    self._queued.discard(msg_id)
+
+    async def _warm(self, msg_id, seconds):
+        worker = self.manager.get_healthy_bot()
+        descriptor = self.manager.media_cache.peek(worker.index, msg_id)
+        if not descriptor:
+            # Resolved by another bot (or not a file); let the stream path handle it
+            cached = self.manager.media_cache.lookup(msg_id, [w.index for w in self.manager.workers])
+            if not cached:
+                return
+            bot_index, descriptor = cached
+            worker = next(w for w in self.manager.workers if w.index == bot_index)
+        if not self.cache.enabled:
+            return
+
+        if descriptor.duration:
+            wanted = descriptor.size * seconds / descriptor.duration
+        else:
+            wanted = FALLBACK_BYTES_PER_SEC * seconds
+        parts = max(1, math.ceil(min(wanted, descriptor.size) / CHUNK_SIZE))
+
+        source = ChunkSource(worker, descriptor, refresh=lambda: self.manager.refresh_media(worker, msg_id))
+        for part in range(parts):
+            offset = part * CHUNK_SIZE
+            await self.cache.get_or_fetch((self.manager.channel_id, msg_id, offset), lambda o=offset: source.read(o))
+        self.warmed += 1
+        logger.debug("🔥 Prefetched %s chunk(s) of msg %s", parts, msg_id)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "warmed": self.warmed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "deferred": self.deferred
+        }
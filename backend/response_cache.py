@@ -0,0 +1,79 @@
+import json
+import time
+import hashlib
+from collections import OrderedDict
+
+def serialize(payload):
+    """Compact JSON bytes, matching what FastAPI's JSONResponse would send."""
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+def make_etag(body):
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match, etag):
+    """Evaluates an If-None-Match header (weak comparison, as RFC 9110 asks for)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "version", "stored_at")
+
+    def __init__(self, body, version):
+        self.body = body
+        self.etag = make_etag(body)
+        self.version = version
+        self.stored_at = time.monotonic()
+
+class ResponseCache:
+    """
+    Serialized-response cache for catalog queries.
+    Keys are normalized query parameters; entries are only valid for the
+    catalog version they were rendered from, expire after `ttl` seconds and
+    are evicted least recently used beyond `max_entries`.
+    """
+    def __init__(self, max_entries=512, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        if version != self._version:
+            # The library changed: everything rendered before is stale
+            self._entries.clear()
+            self._version = version
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry.stored_at > self.ttl:
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, version, payload):
+        entry = CachedResponse(serialize(payload), version)
+        if version == self._version:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "version": self._version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
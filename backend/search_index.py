@@ -0,0 +1,116 @@
+import re
+import math
+import unicodedata
+from bisect import bisect_left
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# BM25 tuning and prefix handling
+K1 = 1.2
+B = 0.75
+PREFIX_WEIGHT = 0.8
+ARTIST_WEIGHT = 0.6
+MAX_EXPANSIONS = 200
+
+def fold(text):
+    """Case- and accent-folds text: 'Beyoncé' -> 'beyonce'."""
+    decomposed = unicodedata.normalize("NFKD", str(text))
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(fold(text)) if text else []
+
+class SearchIndex:
+    """
+    Inverted index over song titles and artists, addressed by catalog position.
+    Every query term is matched as a token prefix (typeahead friendly), terms
+    are ANDed, and hits are ranked with BM25. Title tokens weigh more than
+    artist tokens; an exact token match beats a prefix-only match.
+    """
+    def __init__(self, records):
+        self.postings = {}  # token -> {position: weighted term frequency}
+        self.lengths = []
+        for pos, record in enumerate(records):
+            title, artist = record.search_fields
+            weights = {}
+            for token in tokenize(title):
+                weights[token] = weights.get(token, 0.0) + 1.0
+            for token in tokenize(artist):
+                weights[token] = weights.get(token, 0.0) + ARTIST_WEIGHT
+            for token, tf in weights.items():
+                self.postings.setdefault(token, {})[pos] = tf
+            self.lengths.append(sum(weights.values()))
+        self.doc_count = len(self.lengths)
+        self.avg_length = (sum(self.lengths) / self.doc_count) if self.doc_count else 0.0
+        self.vocabulary = sorted(self.postings)
+
+    def idf(self, token):
+        df = len(self.postings[token])
+        return math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+
+    def expand(self, term):
+        """Vocabulary tokens starting with `term`, most common first when capped."""
+        vocabulary = self.vocabulary
+        matches = []
+        # Walk from the insertion point; slicing would copy the vocabulary tail
+        for i in range(bisect_left(vocabulary, term), len(vocabulary)):
+            token = vocabulary[i]
+            if not token.startswith(term):
+                break
+            matches.append(token)
+        if len(matches) > MAX_EXPANSIONS:
+            matches.sort(key=lambda t: len(self.postings[t]), reverse=True)
+            matches = matches[:MAX_EXPANSIONS]
+            if term in self.postings and term not in matches:
+                matches.append(term)
+        return matches
+
+    def _term_scores(self, term, tokens, allowed):
+        scores = {}
+        for token in tokens:
+            weight = self.idf(token) * (1.0 if token == term else PREFIX_WEIGHT)
+            for pos, tf in self.postings[token].items():
+                if allowed is not None and pos not in allowed:
+                    continue
+                norm = K1 * (1 - B + B * self.lengths[pos] / self.avg_length)
+                score = weight * tf * (K1 + 1) / (tf + norm)
+                if score > scores.get(pos, 0.0):
+                    scores[pos] = score
+        return scores
+
+    def search(self, query, mask):
+        """
+        Returns catalog positions matching every term of `query` and set in
+        `mask`, best BM25 score first (catalog order breaks ties).
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not mask:
+            return []
+
+        expansions = {term: self.expand(term) for term in terms}
+        # Start from the rarest term so the candidate set shrinks fastest
+        terms.sort(key=lambda t: sum(len(self.postings[tok]) for tok in expansions[t]))
+        mask_bytes = mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+        allowed = None
+        totals = {}
+        for term in terms:
+            term_scores = self._term_scores(term, expansions[term], allowed)
+            if allowed is None:
+                term_scores = {
+                    pos: s for pos, s in term_scores.items()
+                    if (pos >> 3) < len(mask_bytes) and mask_bytes[pos >> 3] >> (pos & 7) & 1
+                }
+            totals = {pos: totals.get(pos, 0.0) + s for pos, s in term_scores.items()}
+            allowed = totals.keys()
+            if not totals:
+                return []
+        return sorted(totals, key=lambda pos: (-totals[pos], pos))
+
+    def completions(self, prefix, limit=5):
+        """Most common vocabulary words completing the last typed term."""
+        terms = tokenize(prefix)
+        if not terms:
+            return []
+        matches = self.expand(terms[-1])
+        matches.sort(key=lambda t: len(self.postings[t]), reverse=True)
+        return matches[:limit]
@@ -1,10 +1,15 @@
 import asyncio
+import random
 import re
+import time
 import aiohttp
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 import sys
+from classifier import get_duration_category as category_for_seconds
 
 # 🟢 Load environment variables
 load_dotenv()
@@ -12,7 +17,15 @@ load_dotenv()
 # --- DYNAMIC CONFIGURATION ---
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
 DB_NAME = os.getenv("DB_NAME", "music_app_pro")
-ITUNES_API = "https://itunes.apple.com/search"
+ITUNES_API = os.getenv("ITUNES_API", "https://itunes.apple.com/search")
+
+# --- ENGINE TUNING ---
+REQUESTS_PER_SECOND = float(os.getenv("TAGGER_RATE", "5"))
+BURST = int(os.getenv("TAGGER_BURST", "5"))
+CONCURRENCY = int(os.getenv("TAGGER_CONCURRENCY", "8"))
+WRITE_BATCH = int(os.getenv("TAGGER_WRITE_BATCH", "200"))
+MAX_RETRIES = int(os.getenv("TAGGER_MAX_RETRIES", "5"))
+RETRY_STATUSES = {403, 429, 500, 502, 503, 504}
 
 # Cleaning Regex patterns
 CLEAN_PATTERNS = [
@@ -38,39 +51,248 @@ def clean_title(title):
 def get_duration_category(milliseconds):
     if not milliseconds: return "Mid"
     try:
-        sec = int(milliseconds) / 1000
-        if sec < 180: return "Short"    # < 3 mins
-        if sec < 300: return "Mid"      # 3-5 mins
-        return "Long"                   # > 5 mins
-    except:
+        return category_for_seconds(int(milliseconds) / 1000)
+    except (TypeError, ValueError):
         return "Mid"
 
-async def fetch_metadata(session, title):
-    """Hits iTunes API to get clean Artist, Genre, and Album Art."""
-    term = clean_title(title)
-    try:
-        async with session.get(ITUNES_API, params={"term": term, "limit": 1, "media": "music"}) as resp:
-            data = await resp.json()
-            if data["resultCount"] > 0:
-                result = data["results"][0]
-                return {
-                    "artist": result.get("artistName"),
-                    "genre": result.get("primaryGenreName"),
-                    "album_art": result.get("artworkUrl100").replace("100x100", "600x600"),
-                    "duration_ms": result.get("trackTimeMillis")
-                }
-    except:
-        pass
-    return None
-
-async def main():
+class TransientLookupError(Exception):
+    """The API throttled us or failed; the song must stay un-enriched and be retried later."""
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts up to `burst`."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """
+        Drains the bucket so nobody calls the API for `seconds` (Retry-After).
+        Pauses overlap rather than add up: eight workers throttled together
+        still wait `seconds`, not eight times that.
+        """
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+class ItunesClient:
+    """
+    Thin iTunes Search client. The session and URL are injectable, so tests
+    can point it at a local fake server.
+    """
+    def __init__(self, session, api_url=ITUNES_API):
+        self.session = session
+        self.api_url = api_url
+
+    async def search(self, term):
+        """Returns the raw top hit, None when iTunes has no match, or raises TransientLookupError."""
+        try:
+            async with self.session.get(self.api_url, params={"term": term, "limit": 1, "media": "music"}) as resp:
+                if resp.status in RETRY_STATUSES:
+                    retry_after = resp.headers.get("Retry-After")
+                    raise TransientLookupError(resp.status, float(retry_after) if retry_after and retry_after.isdigit() else None)
+                resp.raise_for_status()
+                # iTunes answers with text/javascript, so skip the content-type check
+                data = await resp.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise TransientLookupError(type(e).__name__, None)
+        if data.get("resultCount", 0) > 0:
+            return data["results"][0]
+        return None
+
+def to_metadata(result):
+    if result is None:
+        return None
+    art = result.get("artworkUrl100")
+    return {
+        "artist": result.get("artistName"),
+        "genre": result.get("primaryGenreName"),
+        "album_art": art.replace("100x100", "600x600") if art else None,
+        "duration_ms": result.get("trackTimeMillis")
+    }
+
+class LookupCache:
+    """
+    Persistent cleaned-title -> metadata cache in a Mongo collection.
+    Definitive answers (including "no match") are stored; throttling and
+    network failures are not, so reruns retry them.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self._memory = {}
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_fetch(self, term, fetch):
+        if term in self._memory:
+            self.hits += 1
+            return self._memory[term]
+        # Duplicate titles in flight share one API call
+        task = self._inflight.get(term)
+        if task is None:
+            task = asyncio.ensure_future(self._load(term, fetch))
+            self._inflight[term] = task
+            task.add_done_callback(lambda _: self._inflight.pop(term, None))
+        else:
+            self.hits += 1
+        return await asyncio.shield(task)
+
+    async def _load(self, term, fetch):
+        doc = await self.collection.find_one({"_id": term})
+        if doc is not None:
+            self.hits += 1
+            meta = doc.get("meta")
+        else:
+            self.misses += 1
+            meta = await fetch(term)
+            await self.collection.update_one(
+                {"_id": term}, {"$set": {"meta": meta, "fetched_at": time.time()}}, upsert=True
+            )
+        self._memory[term] = meta
+        return meta
+
+async def _feed(queue, item, consumers):
+    """
+    Puts `item` on `queue` unless every consumer has stopped; a consumer that
+    crashed re-raises here so producers fail instead of blocking forever.
+    """
+    put = asyncio.ensure_future(queue.put(item))
+    watched = list(consumers)
+    while True:
+        for task in watched:
+            if task.done() and (task.cancelled() or task.exception()):
+                put.cancel()
+                task.result()
+        watched = [task for task in watched if not task.done()]
+        if not watched:
+            put.cancel()
+            raise RuntimeError("Queue consumers exited early")
+        done, _ = await asyncio.wait([put, *watched], return_when=asyncio.FIRST_COMPLETED)
+        if put in done:
+            return
+
+class Enricher:
+    """
+    Enriches songs concurrently: `concurrency` workers share a token bucket,
+    retry throttled lookups with exponential backoff, consult the lookup
+    cache first and hand results to a writer that flushes bulk_write batches.
+    """
+    def __init__(self, collection, cache, client, rate=REQUESTS_PER_SECOND, burst=BURST,
+                 concurrency=CONCURRENCY, write_batch=WRITE_BATCH, max_retries=MAX_RETRIES):
+        self.collection = collection
+        self.cache = cache
+        self.client = client
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self.write_batch = write_batch
+        self.max_retries = max_retries
+        self._writer_task = None
+        self.stats = {"enriched": 0, "not_found": 0, "deferred": 0, "retries": 0, "api_calls": 0}
+
+    async def lookup(self, term):
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            self.stats["api_calls"] += 1
+            try:
+                return to_metadata(await self.client.search(term))
+            except TransientLookupError as e:
+                if attempt == self.max_retries:
+                    raise
+                status, retry_after = e.args
+                delay = retry_after or min(60, 2 ** attempt) * (0.5 + random.random())
+                if status in (403, 429):
+                    # Throttled: slow every worker down, not just this one
+                    self.bucket.pause(delay)
+                self.stats["retries"] += 1
+                await asyncio.sleep(delay)
+
+    def update_for(self, song, meta):
+        # updated_at lets incremental backups and catalog polling pick the edit up
+        now = datetime.now(timezone.utc)
+        if meta:
+            return UpdateOne({"_id": song["_id"]}, {"$set": {
+                "artist": meta["artist"],
+                "genre": meta["genre"],
+                "album_art": meta["album_art"],
+                "duration_category": get_duration_category(meta["duration_ms"]),
+                "is_enriched": True,
+                "updated_at": now
+            }})
+        # Mark as enriched but with fallback genre to avoid re-scanning
+        return UpdateOne({"_id": song["_id"]}, {"$set": {"is_enriched": True, "genre": "Misc", "updated_at": now}})
+
+    async def _worker(self, songs, writes):
+        while True:
+            song = await songs.get()
+            if song is None:
+                return
+            try:
+                meta = await self.cache.get_or_fetch(clean_title(song.get("title") or ""), self.lookup)
+            except TransientLookupError as e:
+                # Leave it un-enriched; the next run picks it up again
+                self.stats["deferred"] += 1
+                print(f"⏳ Deferred '{song.get('title')}': {e.args[0]}")
+                continue
+            self.stats["enriched" if meta else "not_found"] += 1
+            await _feed(writes, self.update_for(song, meta), [self._writer_task])
+
+    async def _writer(self, writes, total):
+        ops = []
+        done = 0
+        while True:
+            op = await writes.get()
+            if op is not None:
+                ops.append(op)
+            if ops and (op is None or len(ops) >= self.write_batch):
+                await self.collection.bulk_write(ops, ordered=False)
+                done += len(ops)
+                print(f"✅ Processed {done}/{total} songs...", end="\r")
+                ops = []
+            if op is None:
+                return
+
+    async def run(self, cursor, total):
+        songs = asyncio.Queue(maxsize=self.concurrency * 4)
+        writes = asyncio.Queue(maxsize=self.write_batch * 2)
+        writer = self._writer_task = asyncio.create_task(self._writer(writes, total))
+        workers = [asyncio.create_task(self._worker(songs, writes)) for _ in range(self.concurrency)]
+        try:
+            async for song in cursor:
+                await _feed(songs, song, workers)
+            for _ in workers:
+                await _feed(songs, None, workers)
+            await asyncio.gather(*workers)
+            await _feed(writes, None, [writer])
+            await writer
+        finally:
+            for task in workers + [writer]:
+                task.cancel()
+        return self.stats
+
+async def main(client_factory=ItunesClient):
     client = AsyncIOMotorClient(MONGO_URL)
     db = client[DB_NAME]
     collection = db.songs
 
     # Only process songs that haven't been enriched yet
-    songs_to_tag = collection.find({"is_enriched": {"$ne": True}})
-    total_found = await collection.count_documents({"is_enriched": {"$ne": True}})
+    pending = {"is_enriched": {"$ne": True}}
+    total_found = await collection.count_documents(pending)
     
     if total_found == 0:
         print("✅ All songs are already enriched.")
@@ -78,63 +300,15 @@ async def main():
 
     print(f"🚀 Starting Smart Tagger for {total_found} songs...")
     
-    async with aiohttp.ClientSession() as session:
-        batch = []
-        counter = 0
-        async for song in songs_to_tag:
-            batch.append(song)
-            
-            if len(batch) >= 10: # Process in small batches to be nice to API
-                results = await asyncio.gather(*[fetch_metadata(session, s["title"]) for s in batch])
-                
-                for s, meta in zip(batch, results):
-                    if meta:
-                        duration_cat = get_duration_category(meta["duration_ms"])
-                        await collection.update_one(
-                            {"_id": s["_id"]},
-                            {"$set": {
-                                "artist": meta["artist"], 
-                                "genre": meta["genre"],
-                                "album_art": meta["album_art"],
-                                "duration_category": duration_cat,
-                                "is_enriched": True
-                            }}
-                        )
-                    else:
-                        # Mark as enriched but with fallback genre to avoid re-scanning
-                        await collection.update_one(
-                            {"_id": s["_id"]}, 
-                            {"$set": {"is_enriched": True, "genre": "Misc"}}
-                        )
-                
-                counter += len(batch)
-                print(f"✅ Processed {counter}/{total_found} songs...", end="\r")
-                batch = []
-                await asyncio.sleep(0.2)
-
-        # Handle leftovers
-        if batch:
-            results = await asyncio.gather(*[fetch_metadata(session, s["title"]) for s in batch])
-            for s, meta in zip(batch, results):
-                if meta:
-                     duration_cat = get_duration_category(meta["duration_ms"])
-                     await collection.update_one(
-                        {"_id": s["_id"]},
-                        {"$set": {
-                            "artist": meta["artist"], 
-                            "genre": meta["genre"],
-                            "album_art": meta["album_art"],
-                            "duration_category": duration_cat,
-                            "is_enriched": True
-                        }}
-                    )
-                else:
-                    await collection.update_one({"_id": s["_id"]}, {"$set": {"is_enriched": True, "genre": "Misc"}})
-            print(f"✅ Processed {total_found}/{total_found} songs.")
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=20)) as session:
+        enricher = Enricher(collection, LookupCache(db.itunes_cache), client_factory(session))
+        stats = await enricher.run(collection.find(pending, {"title": 1}), total_found)
 
+    print(f"\n📊 Enriched: {stats['enriched']}, no match: {stats['not_found']}, "
+          f"deferred: {stats['deferred']}, API calls: {stats['api_calls']}, retries: {stats['retries']}")
     print("\n🎉 Tagger Finished! Restart your server (main.py) to see changes.")
 
 if __name__ == "__main__":
     if sys.platform == 'win32':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
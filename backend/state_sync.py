@@ -0,0 +1,287 @@
+import random
+import asyncio
+import logging
+from pymongo import UpdateOne
+
+logger = logging.getLogger("StateSync")
+
+class StateConflict(Exception):
+    """A patch tried to overwrite fields another client changed after base_version."""
+    def __init__(self, version, state):
+        super().__init__("State version conflict")
+        self.version = version
+        self.state = state
+
+class _PendingWrite:
+    __slots__ = ("doc", "added", "removed", "updates", "marks", "version")
+
+    def __init__(self, doc):
+        self.doc = doc       # the user document the patches were applied to
+        self.added = {}      # song id -> song dict
+        self.removed = set()
+        self.updates = {}
+        self.marks = {}      # field -> [version, client_id] of its latest patch
+        self.version = 0
+
+    def merge(self, other):
+        """Folds an older batch (one that failed to flush) underneath this one."""
+        for song_id, song in other.added.items():
+            if song_id not in self.removed:
+                self.added.setdefault(song_id, song)
+        self.removed |= {i for i in other.removed if i not in self.added}
+        for field, value in other.updates.items():
+            self.updates.setdefault(field, value)
+        for field, mark in other.marks.items():
+            self.marks.setdefault(field, mark)
+        self.version = max(self.version, other.version)
+
+def _song_id(song):
+    return str(song.get("id"))
+
+def _patch_state(state, liked_add, liked_remove, updates):
+    """Applies one patch to a state dict in place."""
+    removed_ids = {str(i) for i in liked_remove} | {_song_id(s) for s in liked_add}
+    liked = state.get("liked_songs") or []
+    if removed_ids:
+        liked = [s for s in liked if _song_id(s) not in removed_ids]
+    state["liked_songs"] = liked + list(liked_add)
+    state.update(updates)
+
+def _state_updates(added, removed, updates, marks=None):
+    """
+    The targeted writes for a batch, in order: the first pulls every touched
+    liked id and $sets changed fields (and their conflict marks), the second,
+    if songs were liked, adds them. MongoDB refuses $pull and $addToSet on
+    one path in a single update, hence two.
+    """
+    first = {}
+    fields = {f"state.{field}": value for field, value in updates.items()}
+    for field, mark in (marks or {}).items():
+        fields[f"state_marks.{field}"] = list(mark)
+    if fields:
+        first["$set"] = fields
+    touched = set(removed) | set(added)
+    if touched:
+        ids = list(touched) + [int(i) for i in touched if i.isdigit()]
+        first["$pull"] = {"state.liked_songs": {"id": {"$in": ids}}}
+    second = {"$addToSet": {"state.liked_songs": {"$each": list(added.values())}}} if added else None
+    return first, second
+
+def _conflicts(marks, base_version, client_id, updates):
+    if base_version is None:
+        return False
+    return any(
+        mark and mark[0] > base_version and mark[1] != client_id
+        for mark in (marks.get(field) for field in updates)
+    )
+
+class StateSyncer:
+    """
+    Applies versioned state patches and coalesces them into debounced writes.
+    Each patch is applied to the cached user document right away (so reads
+    see it) and merged into a per-user pending batch. The batch is written
+    `debounce` seconds after its first patch as one ordered bulk_write:
+    a $pull for touched liked ids plus $set for changed fields, then
+    $addToSet for liked songs.
+    Conflicts are checked per field: a patch is rejected if it sets a field
+    that another client changed after the patch's base_version. The marks
+    recording who changed what (one per field) are stored in the user
+    document as state_marks and cleared by the next full snapshot, in both
+    modes, so the same stale patch gets the same answer however many
+    processes run and however long ago the write was flushed. Writes for
+    one user never overlap: each flush waits for the previous one.
+
+    With `shared=True` (several worker processes) nothing is batched in
+    memory: each patch is written straight away with the same targeted
+    updates, guarded by state_version and bumping it with $inc, so MongoDB
+    hands out every version exactly once, and marks are read from MongoDB
+    rather than the cached user.
+    """
+    SHARED_ATTEMPTS = 8
+
+    def __init__(self, collection, user_cache, load_user, debounce=2.0, shared=False):
+        self.collection = collection
+        self.user_cache = user_cache
+        self.load_user = load_user
+        self.debounce = debounce
+        self.shared = shared
+        self._pending = {}
+        self._timers = {}
+        self._flushing = {}
+        self._flush_done = {}   # username -> Event set when the in-flight flush ends
+        self.patches = 0
+        self.writes = 0
+        self.races = 0
+
+    async def apply(self, username, base_version, client_id, liked_add=(), liked_remove=(), updates=None):
+        """Applies one patch and returns the new state version."""
+        updates = updates or {}
+        if self.shared:
+            return await self._apply_shared(username, base_version, client_id, liked_add, liked_remove, updates)
+        pending = self._pending.get(username)
+        # Keep patching the same document until it is flushed, even if the
+        # cache entry expired in between and a reload would miss our changes
+        user = pending.doc if pending else self._flushing.get(username)
+        if user is None:
+            user = await self.load_user(username)
+        if not user:
+            raise KeyError(username)
+        state = user["state"] = user.get("state") or {}
+        version = user.get("state_version") or 0
+
+        marks = user["state_marks"] = user.get("state_marks") or {}
+        if _conflicts(marks, base_version, client_id, updates):
+            raise StateConflict(version, state)
+        _patch_state(state, liked_add, liked_remove, updates)
+
+        version += 1
+        user["state_version"] = version
+        for field in updates:
+            marks[field] = [version, client_id]
+
+        pending = self._pending.setdefault(username, _PendingWrite(user))
+        for song_id in map(str, liked_remove):
+            pending.added.pop(song_id, None)
+            pending.removed.add(song_id)
+        for song in liked_add:
+            pending.removed.discard(_song_id(song))
+            pending.added[_song_id(song)] = song
+        pending.updates.update(updates)
+        pending.marks.update((field, marks[field]) for field in updates)
+        pending.version = version
+        self.patches += 1
+        self._schedule(username)
+        return version
+
+    async def _apply_shared(self, username, base_version, client_id, liked_add, liked_remove, updates):
+        added = {_song_id(song): song for song in liked_add}
+        removed = {str(i) for i in liked_remove} - set(added)
+        for attempt in range(self.SHARED_ATTEMPTS):
+            if attempt:
+                # Jittered backoff so racing processes stop colliding
+                await asyncio.sleep(random.uniform(0, 0.005 * 2 ** attempt))
+            # Only the version and marks: the state itself is never read here
+            user = await self.collection.find_one({"username": username}, {"state_version": 1, "state_marks": 1})
+            if not user:
+                raise KeyError(username)
+            version = user.get("state_version") or 0
+            if _conflicts(user.get("state_marks") or {}, base_version, client_id, updates):
+                raise StateConflict(version, await self._stored_state(username))
+
+            marks = {field: [version + 1, client_id] for field in updates}
+            first, second = _state_updates(added, removed, updates, marks)
+            first["$inc"] = {"state_version": 1}
+            # Matches only if no other process wrote since our read
+            guard = {"username": username, "state_version": version if "state_version" in user else {"$exists": False}}
+            result = await self.collection.update_one(guard, first)
+            if not result.matched_count:
+                self.races += 1
+                continue
+            if second:
+                # Unguarded: the version is already ours and $addToSet is idempotent
+                await self.collection.update_one({"username": username}, second)
+            self.patches += 1
+            self.writes += 1
+            self._patch_cached(username, version, liked_add, liked_remove, updates, marks)
+            return version + 1
+        # Persistently losing the race: let the client re-read and retry
+        raise StateConflict(version, await self._stored_state(username))
+
+    async def _stored_state(self, username):
+        """The user's state as MongoDB has it, for a 409 body (rare, so a full read is fine)."""
+        user = await self.collection.find_one({"username": username}, {"state": 1})
+        return (user or {}).get("state") or {}
+
+    def _patch_cached(self, username, version, liked_add, liked_remove, updates, marks):
+        """Applies a shared write to the cached user, or drops the entry if it was already stale."""
+        cached = self.user_cache.get(username)
+        if cached is None or (cached.get("state_version") or 0) != version:
+            self.user_cache.invalidate(username)
+            return
+        state = dict(cached.get("state") or {})
+        _patch_state(state, liked_add, liked_remove, updates)
+        self.user_cache.update(
+            username, state=state, state_version=version + 1,
+            state_marks={**(cached.get("state_marks") or {}), **marks}
+        )
+
+    async def replace(self, username):
+        """
+        Call before writing a full-state snapshot. Batched patches are written
+        first (and any in-flight write awaited) so nothing older can land on
+        top of the snapshot and the version keeps increasing.
+        """
+        # Patches that arrived during a flush are pending again: write them too
+        while username in self._pending or username in self._flush_done:
+            if not await self.flush(username):
+                break
+        # Whatever could not be written is superseded by the snapshot
+        self._pending.pop(username, None)
+        timer = self._timers.pop(username, None)
+        if timer:
+            timer.cancel()
+
+    def _schedule(self, username):
+        if username in self._timers:
+            return
+        loop = asyncio.get_running_loop()
+        self._timers[username] = loop.call_later(
+            self.debounce, lambda: asyncio.ensure_future(self.flush(username))
+        )
+
+    async def flush(self, username):
+        """Writes the user's pending batch; returns False if the write failed."""
+        # Several callers (timer, replace, flush_all) can wait on one flush;
+        # whoever wakes first starts the next, so the rest wait again
+        while username in self._flush_done:
+            await self._flush_done[username].wait()
+        timer = self._timers.pop(username, None)
+        if timer:
+            timer.cancel()
+        pending = self._pending.pop(username, None)
+        if not pending:
+            return True
+
+        first, second = _state_updates(pending.added, pending.removed, pending.updates, pending.marks)
+        first.setdefault("$set", {})["state_version"] = pending.version
+        ops = [UpdateOne({"username": username}, update) for update in (first, second) if update]
+
+        self._flushing[username] = pending.doc
+        done = self._flush_done[username] = asyncio.Event()
+        try:
+            await self.collection.bulk_write(ops, ordered=True)
+            self.writes += 1
+            self.user_cache.update(
+                username, state=pending.doc["state"], state_version=pending.version,
+                state_marks=pending.doc["state_marks"]
+            )
+            return True
+        except Exception as e:
+            logger.error("❌ State flush failed for %s, retrying: %s", username, e)
+            newer = self._pending.get(username)
+            if newer:
+                newer.merge(pending)
+            else:
+                self._pending[username] = pending
+            self._schedule(username)
+            return False
+        finally:
+            self._flushing.pop(username, None)
+            self._flush_done.pop(username, None)
+            done.set()
+
+    async def flush_all(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for username in list(self._pending):
+            await self.flush(username)
+
+    def stats(self):
+        return {
+            "pending_users": len(self._pending),
+            "patches": self.patches,
+            "writes": self.writes,
+            "races": self.races,
+            "shared": self.shared
+        }
@@ -0,0 +1,190 @@
+import re
+import time
+import asyncio
+import logging
+from collections import deque
+from telethon import errors
+from starlette.responses import StreamingResponse
+
+logger = logging.getLogger("Streaming")
+
+# Telethon's largest upload.getFile request. Download offsets are kept aligned
+# to it so a request never crosses Telegram's 1 MB block boundary.
+CHUNK_SIZE = 512 * 1024
+
+RANGE_PATTERN = re.compile(r"^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$", re.IGNORECASE)
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a Range header points outside of the file."""
+    def __init__(self, size):
+        super().__init__(f"Range not satisfiable for size {size}")
+        self.size = size
+
+def parse_range_header(header, size):
+    """
+    Turns a 'Range: bytes=...' header into an inclusive (start, end) window.
+    Returns None when the header is missing or malformed (serve the whole file),
+    including a last-pos before first-pos, which RFC 9110 calls invalid.
+    Only the first range of a multi-range request is honoured.
+    """
+    if not header or size <= 0:
+        return None
+
+    first = header.split(",", 1)[0]
+    match = RANGE_PATTERN.match(first)
+    if not match:
+        return None
+
+    start_raw, end_raw = match.groups()
+    if not start_raw and not end_raw:
+        return None
+
+    if not start_raw:
+        # Suffix range: 'bytes=-500' -> last 500 bytes
+        suffix = int(end_raw)
+        if suffix == 0:
+            raise RangeNotSatisfiable(size)
+        return max(size - suffix, 0), size - 1
+
+    start = int(start_raw)
+    if end_raw and int(end_raw) < start:
+        return None
+    end = int(end_raw) if end_raw else size - 1
+    if start >= size:
+        raise RangeNotSatisfiable(size)
+    return start, min(end, size - 1)
+
+def aligned_offset(position):
+    """Rounds a byte position down to the chunk grid used for Telegram requests."""
+    return position - (position % CHUNK_SIZE)
+
+class ChunkSource:
+    """
+    One bot's view of a file: a BotWorker plus the MediaDescriptor it resolved.
+    Every read is a single upload.getFile request for one aligned chunk, so
+    several reads can be in flight on the same connection at once.
+    `refresh` is awaited for a new descriptor when the file reference expires.
+    """
+    def __init__(self, worker, descriptor, refresh=None):
+        self.worker = worker
+        self.descriptor = descriptor
+        self.refresh = refresh
+
+    async def read(self, offset):
+        chunk = b""
+        started = time.monotonic()
+        self.worker.begin_request()
+        try:
+            chunk = await self._read(offset)
+            return chunk
+        finally:
+            self.worker.end_request(len(chunk), time.monotonic() - started)
+
+    async def _read(self, offset):
+        try:
+            return await self._request(offset)
+        except errors.FloodWaitError as e:
+            self.worker.trigger_cooldown(e.seconds)
+            raise
+        except (errors.FileReferenceExpiredError, errors.FilerefUpgradeNeededError):
+            if not self.refresh:
+                raise
+            logger.info("♻️ File reference expired for msg %s, refreshing", self.descriptor.msg_id)
+            self.descriptor = await self.refresh()
+            return await self._request(offset)
+        except Exception:
+            self.worker.record_error()
+            raise
+
+    async def _request(self, offset):
+        descriptor = self.descriptor
+        iterator = self.worker.client.iter_download(
+            descriptor.location(),
+            offset=offset,
+            limit=1,
+            request_size=CHUNK_SIZE,
+            file_size=descriptor.size,
+            dc_id=descriptor.dc_id
+        )
+        try:
+            async for chunk in iterator:
+                return chunk
+            return b""
+        finally:
+            if hasattr(iterator, "close"):
+                await iterator.close()
+
+async def iter_file_range(sources, start, end, cache=None, cache_key=None, window=4):
+    """
+    Streams bytes [start, end] of a Telegram file.
+    The range is split into CHUNK_SIZE-aligned parts and up to `window` parts
+    are fetched concurrently, spread round-robin over `sources` (one per bot).
+    Parts are yielded strictly in order as soon as the head part is ready, so
+    the reorder buffer never holds more than `window` chunks. A seek only
+    costs the bytes after the seek point instead of the whole file.
+    When a ChunkCache is given, parts are keyed by cache_key + (offset,) and
+    served from disk if present, filling the cache as the stream goes.
+    """
+    last_offset = aligned_offset(end)
+    next_offset = aligned_offset(start)
+    part_index = 0
+    pending = deque()
+    primary = sources[0]
+
+    async def read_part(source, offset):
+        try:
+            return await source.read(offset)
+        except Exception as e:
+            if source is primary:
+                raise
+            # A helper bot failing (FloodWait, dropped connection) must not
+            # kill the stream; the primary bot picks the part up instead.
+            logger.warning("⚠️ Bot %s failed part %s: %s", source.worker.index + 1, offset, e)
+            return await primary.read(offset)
+
+    def schedule():
+        nonlocal next_offset, part_index
+        while len(pending) < window and next_offset <= last_offset:
+            source = sources[part_index % len(sources)]
+            offset = next_offset
+            if cache is not None:
+                fetch = cache.get_or_fetch((*cache_key, offset), lambda s=source, o=offset: read_part(s, o))
+            else:
+                fetch = read_part(source, offset)
+            pending.append((offset, asyncio.ensure_future(fetch)))
+            next_offset += CHUNK_SIZE
+            part_index += 1
+
+    try:
+        schedule()
+        while pending:
+            offset, task = pending.popleft()
+            chunk = await task
+            schedule()
+            if not chunk:
+                break
+
+            view = chunk[max(start - offset, 0):end - offset + 1]
+            if view:
+                yield view
+            if len(chunk) < CHUNK_SIZE:
+                break
+    finally:
+        for _, task in pending:
+            task.cancel()
+
+class LeasedStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that calls `on_close` however the response ends:
+    fully sent, failed, or cancelled by a client disconnect, including before
+    the body iterator was ever started (where a generator's finally never runs).
+    """
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
@@ -0,0 +1,47 @@
+from catalog import SongRecord
+from search_index import MAX_EXPANSIONS, SearchIndex, fold
+
+def build(*songs):
+    records = [
+        SongRecord({"_id": i, "title": title, "artist": artist})
+        for i, (title, artist) in enumerate(songs)
+    ]
+    return SearchIndex(records), (1 << len(records)) - 1
+
+def test_fold_strips_case_and_accents():
+    assert fold("Beyoncé") == "beyonce"
+    assert fold("ÁRVÍZTŰRŐ") == "arvizturo"
+
+def test_prefix_matches_every_completion():
+    index, mask = build(("Lovely", "Billie"), ("Love Story", "Taylor"), ("Loser", "Beck"), ("Halo", "Beyoncé"))
+    assert sorted(index.search("lov", mask)) == [0, 1]
+    assert index.search("lo", mask) != []
+    assert index.search("lovex", mask) == []
+    assert index.expand("lov") == ["love", "lovely"]
+
+def test_accents_fold_both_ways():
+    index, mask = build(("Halo", "Beyoncé"), ("Café del Mar", "Energy 52"))
+    assert index.search("beyonce", mask) == [0]
+    assert index.search("BEYONCÉ", mask) == [0]
+    assert index.search("cafe", mask) == [1]
+
+def test_terms_are_anded_and_mask_applies():
+    index, mask = build(("Love Story", "Taylor Swift"), ("Love Song", "Adele"), ("Story of My Life", "One Direction"))
+    assert index.search("love story", mask) == [0]
+    assert index.search("love", mask & ~1) == [1]
+    assert index.search("love", 0) == []
+
+def test_exact_token_outranks_prefix_and_title_outranks_artist():
+    index, mask = build(("Loveless", "Band A"), ("Love", "Band B"), ("Other", "Lovers"))
+    # Exact title token first, then the prefix-only title, the artist-only hit last
+    assert index.search("love", mask) == [1, 0, 2]
+
+def test_expand_caps_to_most_common_and_keeps_exact_term():
+    # Every zzNNNN token is in two songs, zz0007 in three, the bare "zz" in one
+    songs = [(f"zz{i:04d}", "x") for i in range(MAX_EXPANSIONS + 50)] * 2
+    songs += [("zz0007", "y"), ("zz", "y")]
+    index, _ = build(*songs)
+    matches = index.expand("zz")
+    assert len(matches) == MAX_EXPANSIONS + 1
+    assert matches[0] == "zz0007"
+    assert matches[-1] == "zz"
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from auth_cache import UserCache
+from state_sync import StateConflict, StateSyncer
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+class SequentialBulk:
+    """mongomock's bulk_write rejects the UpdateOne of current pymongo; run the ops one by one."""
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            await self.collection.update_one(op._filter, op._doc)
+
+def syncer(collection, shared):
+    cache = UserCache()
+
+    async def load_user(username):
+        user = cache.get(username)
+        if user is None:
+            user = await collection.find_one({"username": username}, {field: 1 for field in UserCache.FIELDS})
+            if user:
+                user = cache.put(user)
+        return user
+
+    return StateSyncer(collection, cache, load_user, debounce=0.01, shared=shared)
+
+async def stale_patch_outcomes(shared):
+    collection = SequentialBulk(mongomock_motor.AsyncMongoMockClient()["test"]["users"])
+    await collection.insert_one({"username": "u", "state": {"volume": 0.5}, "state_version": 0})
+    outcomes = []
+
+    async def attempt(sync, client_id, **updates):
+        try:
+            await sync.apply("u", 0, client_id, updates=updates)
+            outcomes.append("ok")
+        except StateConflict:
+            outcomes.append("conflict")
+
+    phone = syncer(collection, shared)
+    await attempt(phone, "phone", volume=0.1)
+    await phone.flush_all()
+    # Long after the write reached MongoDB, and from a fresh process
+    await asyncio.sleep(0.05)
+    laptop = syncer(collection, shared)
+    await attempt(laptop, "laptop", volume=0.9)
+    await attempt(laptop, "laptop", selected_language="hindi")
+    await attempt(laptop, "phone", volume=0.2)
+    await laptop.flush_all()
+    user = await collection.find_one({"username": "u"})
+    return outcomes, user["state"], user["state_version"]
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_stale_patch_gets_the_same_answer_in_both_modes(shared):
+    outcomes, state, version = asyncio.run(stale_patch_outcomes(shared))
+    # Only the stale write to a field another client changed is refused
+    assert outcomes == ["ok", "conflict", "ok", "ok"]
+    assert state == {"volume": 0.2, "selected_language": "hindi"}
+    assert version == 3
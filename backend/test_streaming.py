@@ -0,0 +1,26 @@
+import pytest
+
+from streaming import RangeNotSatisfiable, parse_range_header
+
+SIZE = 1000
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=900-", (900, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=0-0, 5-9", (0, 0)),
+])
+def test_satisfiable_ranges(header, expected):
+    assert parse_range_header(header, SIZE) == expected
+
+@pytest.mark.parametrize("header", [None, "", "bytes=", "bytes=-", "items=0-5", "bytes=a-b", "bytes=5-3", "bytes=1500-1200"])
+def test_missing_malformed_or_invalid_ranges_serve_the_whole_file(header):
+    # bytes=5-3 has its last position before its first: invalid, so ignored (RFC 9110 14.1.1)
+    assert parse_range_header(header, SIZE) is None
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=1500-2000", "bytes=-0"])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header(header, SIZE)
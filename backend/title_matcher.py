@@ -0,0 +1,99 @@
+from collections import Counter
+from difflib import SequenceMatcher
+from itertools import islice
+
+# Ranked trigram candidates that get a full SequenceMatcher comparison
+MAX_CANDIDATES = 25
+# Trigrams in more than this share of titles (" th", "the") are skipped when
+# ranking: they say little about similarity and would touch nearly every title
+MAX_POSTING_SHARE = 0.05
+# ...but small libraries use every trigram
+MIN_POSTING_LIMIT = 64
+
+def normalize_title(title):
+    return str(title).lower().strip()
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TitleMatcher:
+    """
+    Fuzzy lookup of incoming file names against unverified song titles.
+    Normalized titles are indexed by character trigrams; a query only scores
+    titles that share its rarer trigrams, and only the best-ranked few are
+    compared with SequenceMatcher using difflib's cutoff semantics.
+    `remove` drops a song title in O(its keys) through a reverse map.
+    """
+    def __init__(self, max_candidates=MAX_CANDIDATES):
+        self.max_candidates = max_candidates
+        self.titles = {}        # normalized key -> db title
+        self.keys_by_title = {}  # db title -> normalized keys
+        self.postings = {}      # trigram -> keys
+
+    def __len__(self):
+        return len(self.titles)
+
+    def add(self, title):
+        key = normalize_title(title)
+        previous = self.titles.get(key)
+        if previous is not None and previous != title:
+            self._unlink(key, previous)
+        self.titles[key] = title
+        self.keys_by_title.setdefault(title, set()).add(key)
+        for gram in trigrams(key):
+            self.postings.setdefault(gram, set()).add(key)
+
+    def _unlink(self, key, title):
+        keys = self.keys_by_title.get(title)
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_title[title]
+
+    def remove(self, title):
+        for key in self.keys_by_title.pop(title, ()):
+            del self.titles[key]
+            for gram in trigrams(key):
+                bucket = self.postings.get(gram)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self.postings[gram]
+
+    def candidates(self, key):
+        """
+        Titles sharing the most trigrams with `key`. Only posting lists of at
+        most `limit` titles are scanned, so a query costs O(its trigrams *
+        limit) rather than O(library). A query made of common trigrams only
+        samples `limit` titles of its rarest one.
+        """
+        limit = max(MIN_POSTING_LIMIT, int(len(self.titles) * MAX_POSTING_SHARE))
+        buckets = sorted(filter(None, map(self.postings.get, trigrams(key))), key=len)
+        shared = Counter()
+        for bucket in buckets:
+            if len(bucket) > limit:
+                break
+            shared.update(bucket)
+        if not shared and buckets:
+            shared.update(islice(buckets[0], limit))
+        return [candidate for candidate, _ in shared.most_common(self.max_candidates)]
+
+    def match(self, file_title, cutoff=0.80):
+        """Returns the db title best matching `file_title`, or None below `cutoff`."""
+        key = normalize_title(file_title)
+        title = self.titles.get(key)
+        if title is not None:
+            return title
+
+        matcher = SequenceMatcher()
+        matcher.set_seq2(key)
+        best_score, best_key = cutoff, None
+        for candidate in self.candidates(key):
+            matcher.set_seq1(candidate)
+            if (matcher.real_quick_ratio() >= best_score and
+                    matcher.quick_ratio() >= best_score):
+                score = matcher.ratio()
+                if score >= best_score and (best_key is None or score > best_score):
+                    best_score, best_key = score, candidate
+        return self.titles[best_key] if best_key is not None else None
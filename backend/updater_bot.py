@@ -1,11 +1,13 @@
 import logging
 import asyncio
-import difflib
 import re
 import os
+import time
+from datetime import datetime, timezone
 from telethon import TelegramClient, events
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
+from title_matcher import TitleMatcher
 
 # 🟢 Initialize the vault
 load_dotenv()
@@ -16,20 +18,44 @@ API_HASH = os.getenv("API_HASH")
 BOT_TOKEN = os.getenv("BOT_TOKEN_1")
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
 DB_NAME = os.getenv("DB_NAME", "music_app_pro")
+VERIFY_BATCH = int(os.getenv("VERIFY_BATCH", "200"))
+VERIFY_FLUSH_SECONDS = float(os.getenv("VERIFY_FLUSH_SECONDS", "2"))
 
 # Database setup
 mongo_client = AsyncIOMotorClient(MONGO_URL)
 db = mongo_client[DB_NAME]
-unverified_cache = {}
+unverified = TitleMatcher()
+pending_verified = []
 
 async def load_cache():
-    global unverified_cache
-    unverified_cache = {}
-    cursor = db.songs.find({"is_verified": {"$ne": True}})
+    global unverified
+    unverified = TitleMatcher()
+    cursor = db.songs.find({"is_verified": {"$ne": True}}, {"title": 1})
     async for song in cursor:
-        clean = song['title'].lower().strip()
-        unverified_cache[clean] = song['title']
-    print(f"🧠 Watching for {len(unverified_cache)} missing songs.")
+        unverified.add(song['title'])
+    print(f"🧠 Watching for {len(unverified)} missing songs.")
+
+async def flush_verified():
+    """Marks every queued title verified with one update_many."""
+    if not pending_verified:
+        return
+    titles = list(dict.fromkeys(pending_verified))
+    pending_verified.clear()
+    try:
+        result = await db.songs.update_many(
+            {"title": {"$in": titles}},
+            {"$set": {"is_verified": True, "last_updated": time.time(), "updated_at": datetime.now(timezone.utc)}}
+        )
+        print(f"✅ Verified {len(titles)} titles ({result.modified_count} songs)")
+    except Exception as e:
+        # Keep them queued for the next flush
+        print(f"⚠️ Verification write failed, will retry: {e}")
+        pending_verified.extend(titles)
+
+async def flush_loop():
+    while True:
+        await asyncio.sleep(VERIFY_FLUSH_SECONDS)
+        await flush_verified()
 
 async def main():
     await load_cache()
@@ -44,29 +70,23 @@ async def main():
     async def handler(event):
         if event.audio or event.document:
             file_title = event.file.name or "Unknown"
-            clean_input = file_title.lower().strip()
-            
-            db_title = unverified_cache.get(clean_input)
-            if not db_title:
-                matches = difflib.get_close_matches(clean_input, unverified_cache.keys(), n=1, cutoff=0.80)
-                if matches:
-                    db_title = unverified_cache[matches[0]]
+            db_title = unverified.match(file_title, cutoff=0.80)
 
             if db_title:
-                try:
-                    await db.songs.update_one(
-                        {"title": db_title},
-                        {"$set": {"is_verified": True, "last_updated": asyncio.get_event_loop().time()}}
-                    )
-                    print(f"✅ Verified: {db_title}")
-                    # Remove from local cache to save resources
-                    key = [k for k, v in unverified_cache.items() if v == db_title]
-                    if key: del unverified_cache[key[0]]
-                except:
-                    pass
+                print(f"🎯 Matched: {db_title}")
+                # Remove from the matcher so later uploads can't claim it again
+                unverified.remove(db_title)
+                pending_verified.append(db_title)
+                if len(pending_verified) >= VERIFY_BATCH:
+                    await flush_verified()
 
+    flusher = asyncio.create_task(flush_loop())
     print("🤖 Updater Bot is Live...")
-    await bot.run_until_disconnected()
+    try:
+        await bot.run_until_disconnected()
+    finally:
+        flusher.cancel()
+        await flush_verified()
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
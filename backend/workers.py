@@ -0,0 +1,69 @@
+import os
+import time
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows: only single-process mode is supported
+    fcntl = None
+
+logger = logging.getLogger("Workers")
+
+# Next to this module, not the CWD, so every worker of one install agrees on it
+DEFAULT_LOCK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions")
+
+def worker_count():
+    """Number of uvicorn worker processes (WEB_CONCURRENCY, default 1)."""
+    return max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+class WorkerSlot:
+    """
+    An exclusive slot 0..count-1 held through an flock on <lock dir>/worker_slot_N.lock.
+    The OS drops the lock when the process dies, so a restarted worker
+    takes over the slot (and the bot sessions) of the one it replaces.
+    """
+    def __init__(self, index, count, handle=None):
+        self.index = index
+        self.count = count
+        self._handle = handle
+
+    @property
+    def is_primary(self):
+        """Slot 0 runs the once-per-box housekeeping (cache eviction)."""
+        return self.index == 0
+
+    def release(self):
+        if self._handle:
+            self._handle.close()
+            self._handle = None
+
+def claim_slot(count, lock_dir=None, timeout=None):
+    """
+    Blocks until one of `count` slots is free and returns it.
+    Raises RuntimeError after `timeout` seconds (WORKER_SLOT_TIMEOUT, 30).
+    Lock files live in `lock_dir` (WORKER_LOCK_DIR, backend/sessions); a
+    single worker needs no lock and creates none.
+    """
+    if count <= 1:
+        return WorkerSlot(0, 1)
+    if fcntl is None:
+        raise RuntimeError("WEB_CONCURRENCY > 1 needs fcntl (Linux/macOS)")
+
+    timeout = float(os.getenv("WORKER_SLOT_TIMEOUT", "30")) if timeout is None else timeout
+    lock_dir = lock_dir or os.getenv("WORKER_LOCK_DIR") or DEFAULT_LOCK_DIR
+    os.makedirs(lock_dir, exist_ok=True)
+    deadline = time.monotonic() + timeout
+    while True:
+        for index in range(count):
+            handle = open(os.path.join(lock_dir, f"worker_slot_{index}.lock"), "a")
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                continue
+            logger.info("🧩 Worker %s claimed slot %s/%s", os.getpid(), index + 1, count)
+            return WorkerSlot(index, count, handle)
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f"All {count} worker slots are taken (is another instance running?)")
+        # A replaced worker may still be shutting down and holding its slot
+        time.sleep(0.5)
@@ -57,23 +57,45 @@ api.interceptors.response.use(
 );
 
 // --- FETCH SONGS ---
-export const fetchSongs = async (search, limit, genre, mood, listen, skip = 0, language = 'all') => {
+// 🟢 LOGIC: Pass the server's next_cursor back for deep pages (keyset pagination)
+export const fetchSongs = async (search, limit, genre, mood, listen, skip = 0, language = 'all', cursor = null) => {
   try {
     const response = await api.get('/songs', {
       params: {
         search: search || '',
         limit: limit || 50,
-        skip: skip || 0,
+        skip: cursor ? 0 : (skip || 0),
         genre: genre || 'all', 
         mood: mood || 'all', 
         listen: listen || 'all',
-        language: language || 'all' 
+        language: language || 'all',
+        ...(cursor ? { cursor } : {})
       },
     });
-    return response.data.results;
+    return { results: response.data.results, nextCursor: response.data.next_cursor ?? null };
   } catch (error) {
     console.error("❌ [API ERROR] Failed to fetch songs:", error);
-    return [];
+    return { results: [], nextCursor: null };
+  }
+};
+
+// --- FACET COUNTS ---
+// 🟢 LOGIC: One cheap call returns per-option counts for every filter dropdown
+export const fetchFacets = async (search, genre, mood, listen, language) => {
+  try {
+    const response = await api.get('/songs/facets', {
+      params: {
+        search: search || '',
+        genre: genre || 'all',
+        mood: mood || 'all',
+        listen: listen || 'all',
+        language: language || 'all'
+      },
+    });
+    return response.data;
+  } catch (error) {
+    console.error("❌ [API ERROR] Failed to fetch facets:", error);
+    return null;
   }
 };
 
@@ -81,4 +103,12 @@ export const fetchSongs = async (search, limit, genre, mood, listen, skip = 0, l
 export const getStreamUrl = (msgId) => {
   if (!msgId) return '';
   return `${API_URL}/stream/${msgId}`;
-};
\ No newline at end of file
+};
+
+// --- PREFETCH UTILITY ---
+// Fire-and-forget: asks the server to warm the next tracks so skips start instantly
+export const prefetchSongs = (msgIds) => {
+  const ids = (msgIds || []).filter(Boolean);
+  if (ids.length === 0) return;
+  api.post('/stream/prefetch', { msg_ids: ids }).catch(() => {});
+};
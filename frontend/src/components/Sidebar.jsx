@@ -13,7 +13,8 @@ const Sidebar = () => {
     selectedMood, setMood,
     selectedDuration, setDuration,
     selectedLanguage, setLanguage,
-    resetFilters, fetchSongs
+    resetFilters, fetchSongs,
+    facets
   } = useMusicStore();
 
   const handleReset = () => {
@@ -88,6 +89,7 @@ const Sidebar = () => {
 
           <FilterSelect 
             label="Genre"
+            counts={facets?.genre}
             value={selectedGenre}
             onChange={(e) => handleFilterChange(setGenre, e.target.value)}
             options={[
@@ -102,6 +104,7 @@ const Sidebar = () => {
 
           <FilterSelect 
             label="Language"
+            counts={facets?.language}
             value={selectedLanguage}
             onChange={(e) => handleFilterChange(setLanguage, e.target.value)}
             options={[
@@ -116,6 +119,7 @@ const Sidebar = () => {
 
           <FilterSelect 
             label="Duration"
+            counts={facets?.listen}
             value={selectedDuration}
             onChange={(e) => handleFilterChange(setDuration, e.target.value)}
             options={[
@@ -128,6 +132,7 @@ const Sidebar = () => {
 
           <FilterSelect 
             label="Mood"
+            counts={facets?.mood}
             value={selectedMood}
             onChange={(e) => handleFilterChange(setMood, e.target.value)}
             options={[
@@ -198,7 +203,14 @@ const NavItem = ({ active, onClick, icon, label, badge }) => (
 );
 
 // Reusable Filter Select
-const FilterSelect = ({ value, onChange, options }) => (
+// 🟢 Appends the server's facet count, e.g. "Pop (128)"
+const withCount = (opt, counts) => {
+  if (!counts || opt.v === 'all') return opt.t;
+  const match = counts.find(c => c.value.toLowerCase() === opt.v.toLowerCase());
+  return match ? `${opt.t} (${match.count})` : opt.t;
+};
+
+const FilterSelect = ({ value, onChange, options, counts }) => (
   <div className="relative">
     <select 
       value={value} 
@@ -207,7 +219,7 @@ const FilterSelect = ({ value, onChange, options }) => (
     >
       {options.map(opt => (
         <option key={opt.v} value={opt.v} className="bg-zinc-900 text-white">
-          {opt.t}
+          {withCount(opt, counts)}
         </option>
       ))}
     </select>
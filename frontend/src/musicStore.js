@@ -1,9 +1,12 @@
 import { create } from 'zustand';
 import { persist, createJSONStorage } from 'zustand/middleware';
-import { fetchSongs as fetchSongsApi } from './api'; 
+import { fetchSongs as fetchSongsApi, fetchFacets as fetchFacetsApi, prefetchSongs } from './api'; 
 import axios from 'axios';
 import { API_URL } from './api';
 
+// 🟢 Identifies this tab so the server only flags edits from *other* devices as conflicts
+const CLIENT_ID = Math.random().toString(36).slice(2);
+
 // 🟢 Define a "Factory Default" state for clean handovers
 const initialState = {
   songs: [],
@@ -15,12 +18,14 @@ const initialState = {
   currentTime: 0, 
   isPlayerOpen: false,
   skip: 0,
+  nextCursor: null,
   hasMore: true,
   searchQuery: '',
   selectedGenre: 'all',
   selectedMood: 'all',
   selectedDuration: 'all',
   selectedLanguage: 'all', 
+  facets: null,
 };
 
 const useMusicStore = create(
@@ -28,6 +33,7 @@ const useMusicStore = create(
     (set, get) => ({
       ...initialState,
       user: null, 
+      stateVersion: 0,
       volume: 0.7,
       isMuted: false,
       prevVolume: 0.7,
@@ -36,10 +42,10 @@ const useMusicStore = create(
       login: async (username, password) => {
         try {
           const res = await axios.post(`${API_URL}/auth/login`, { username, password });
-          const { access_token, state } = res.data;
+          const { access_token, state, state_version } = res.data;
           
           // 🛡️ RESET TO DEFAULTS: Scrub UI data before applying new user credentials
-          set({ ...initialState, user: { username, access_token } });
+          set({ ...initialState, user: { username, access_token }, stateVersion: state_version || 0 });
 
           // ☁️ MERGE CLOUD STATE: Apply permanent preferences from MongoDB
           if (state) {
@@ -60,27 +66,35 @@ const useMusicStore = create(
 
       logout: () => {
         // 🧹 Wipe everything back to factory defaults to prevent session leakage
-        set({ ...initialState, user: null });
+        set({ ...initialState, user: null, stateVersion: 0 });
         localStorage.removeItem('music-pro-storage-v16');
       },
 
       // --- CLOUD SYNC ENGINE ---
-      syncToCloud: async () => {
-        const { user, likedSongs, currentSong, volume, selectedLanguage } = get();
+      // Sends only what changed: { liked_add, liked_remove, updates }
+      syncToCloud: async (patch) => {
+        const { user, stateVersion } = get();
         if (!user?.access_token) return;
 
         try {
-          await axios.post(
-            `${API_URL}/user/sync`, 
-            {
-              liked_songs: likedSongs,
-              current_song: currentSong,
-              volume: volume,
-              selected_language: selectedLanguage
-            },
+          const res = await axios.post(
+            `${API_URL}/user/sync/patch`, 
+            { base_version: stateVersion, client_id: CLIENT_ID, ...patch },
             { headers: { Authorization: `Bearer ${user.access_token}` } }
           );
+          set({ stateVersion: Math.max(get().stateVersion, res.data.version) });
         } catch (e) {
+          if (e.response?.status === 409) {
+            // ⚔️ Another device changed these settings first: adopt the server copy
+            const { state, version } = e.response.data;
+            set({
+              stateVersion: version,
+              likedSongs: state.liked_songs || [],
+              volume: state.volume ?? get().volume,
+              selectedLanguage: state.selected_language || "all"
+            });
+            return;
+          }
           console.error("Cloud Sync Failed:", e);
         }
       },
@@ -109,27 +123,27 @@ const useMusicStore = create(
       setLanguage: (language) => {
         set({ selectedLanguage: language, skip: 0, songs: [], hasMore: true });
         get().fetchSongs();
-        get().syncToCloud(); 
+        get().syncToCloud({ updates: { selected_language: language } }); 
       },
       
       setVolume: (vol) => {
         if (vol === 0) set({ volume: 0, isMuted: true });
         else set({ volume: vol, isMuted: false, prevVolume: vol });
-        get().syncToCloud(); 
+        get().syncToCloud({ updates: { volume: get().volume } }); 
       },
 
       toggleMute: () => {
         const { isMuted, volume, prevVolume } = get();
         if (isMuted) set({ isMuted: false, volume: prevVolume || 0.7 });
         else set({ isMuted: true, prevVolume: volume, volume: 0 });
-        get().syncToCloud();
+        get().syncToCloud({ updates: { volume: get().volume } });
       },
 
       // --- FETCH ENGINE (With Deduplication) ---
       fetchSongs: async (isLoadMore = false) => {
         const { 
           searchQuery, selectedGenre, selectedMood, selectedDuration, selectedLanguage, 
-          skip, songs, hasMore, isLoading 
+          skip, nextCursor, songs, hasMore, isLoading 
         } = get();
         
         if (isLoading) return; 
@@ -137,12 +151,19 @@ const useMusicStore = create(
 
         set({ isLoading: true });
 
+        // 🟢 LOGIC: Refresh the dropdown counts whenever the filter context changes
+        if (!isLoadMore) {
+          fetchFacetsApi(searchQuery, selectedGenre, selectedMood, selectedDuration, selectedLanguage)
+            .then((facets) => { if (facets) set({ facets }); });
+        }
+
         try {
           const limit = 50; 
-          const results = await fetchSongsApi(
+          const { results, nextCursor: newCursor } = await fetchSongsApi(
             searchQuery, limit, selectedGenre, selectedMood, selectedDuration, 
             isLoadMore ? skip : 0, 
-            selectedLanguage
+            selectedLanguage,
+            isLoadMore ? nextCursor : null
           );
 
           const newRawSongs = results || [];
@@ -171,7 +192,8 @@ const useMusicStore = create(
             return { 
               songs: uniqueSongs,
               skip: isLoadMore ? state.skip + limit : limit,
-              hasMore: newRawSongs.length === limit, 
+              nextCursor: newCursor,
+              hasMore: newCursor ? true : newRawSongs.length === limit, 
               isLoading: false 
             };
           });
@@ -189,7 +211,15 @@ const useMusicStore = create(
       // --- PLAYBACK ---
       setCurrentSong: (song) => {
         set({ currentSong: song, isPlaying: true, currentTime: 0 });
-        get().syncToCloud(); 
+        get().syncToCloud({ updates: { current_song: song } }); 
+
+        // 🟢 LOGIC: Warm the next two tracks server-side for gapless skips
+        const { songs, likedSongs, view } = get();
+        const activeList = view === 'home' ? songs : likedSongs;
+        const index = activeList.findIndex(s => String(s.id) === String(song?.id));
+        if (index !== -1) {
+          prefetchSongs(activeList.slice(index + 1, index + 3).map(s => s.msg_id));
+        }
       },
       pauseSong: () => set({ isPlaying: false }),
       resumeSong: () => set({ isPlaying: true }),
@@ -220,10 +250,11 @@ const useMusicStore = create(
         
         if (isLiked) {
             set({ likedSongs: likedSongs.filter(s => String(s.id) !== songId) });
+            get().syncToCloud({ liked_remove: [songId] });
         } else {
             set({ likedSongs: [...likedSongs, song] });
+            get().syncToCloud({ liked_add: [song] });
         }
-        get().syncToCloud(); 
       },
 
       resetFilters: () => {
@@ -236,6 +267,7 @@ const useMusicStore = create(
       storage: createJSONStorage(() => localStorage),
       partialize: (state) => ({ 
         user: state.user,
+        stateVersion: state.stateVersion,
         likedSongs: state.likedSongs,
         volume: state.volume,
         selectedLanguage: state.selectedLanguage 